@@ -0,0 +1,62 @@
+"""Concurrent request throughput against a running server.
+
+Start the app the same way the Procfile does and point this script at it:
+
+    gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
+    python benchmarks/concurrency.py --url "http://127.0.0.1:8000/songs?q=the" -c 64 -n 2000
+
+Run it once on a checkout before the change and once after to compare.
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def _request(url, headers):
+    start = time.perf_counter()
+    r = _session().get(url, headers=headers)
+    return time.perf_counter() - start, r.status_code
+
+
+def run(url, concurrency, total, headers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: _request(url, headers), range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status_code in results if status_code >= 400)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/songs")
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("--user-id", default=None)
+    args = parser.parse_args()
+
+    request_headers = {"x-user-id": args.user_id} if args.user_id else {}
+    for key, value in run(args.url, args.concurrency, args.requests, request_headers).items():
+        print(f"{key:>15}: {value}")
@@ -0,0 +1,88 @@
+"""Serialization cost of list responses, with and without FAST_JSON_RESPONSES.
+
+Runs in process, without a server or database:
+
+    python benchmarks/serialization.py --sizes 1000 10000 -r 5
+
+"default" is what FastAPI does with response_model: validate every document against the model, encode it and
+render it with the standard json module. "fast" is utils.fast_json: keep the model fields and render with orjson.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import sys
+import time
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models.album import AlbumModel  # noqa: E402
+from models.playlist import PlaylistModel  # noqa: E402
+from models.song import SongModel  # noqa: E402
+from utils.fast_json import shape  # noqa: E402
+
+
+def _ids(count):
+    return [str(ObjectId()) for _ in range(count)]
+
+
+# Documents as the services return them, internal fields included
+def _song(i):
+    return {"id": str(ObjectId()), "name": f"song {i}", "artists": ["Artist one", "Artist two"], "genre": "rock",
+            "status": "active", "date_created": datetime.datetime.utcnow(), "date_uploaded": datetime.datetime.utcnow(),
+            "duration": 215.32, "bitrate": 320, "subscription_level": 1, "updated_at": datetime.datetime.utcnow(),
+            "content_key": "content/0123456789abcdef.mp3", "content_hash": "0123456789abcdef", "score": 2}
+
+
+def _album(i):
+    return {"id": str(ObjectId()), "name": f"album {i}", "artists": ["Artist one"], "songs": _ids(12), "year": 2022,
+            "cover": None, "date_created": datetime.datetime.utcnow(), "subscription_level": 0,
+            "updated_at": datetime.datetime.utcnow()}
+
+
+def _playlist(i):
+    return {"id": str(ObjectId()), "name": f"playlist {i}", "owner": "user@test.com", "songs": _ids(20),
+            "cover": None, "date_created": datetime.datetime.utcnow(), "updated_at": datetime.datetime.utcnow()}
+
+
+def _default(field, docs):
+    content = asyncio.run(serialize_response(field=field, response_content=docs))
+    return JSONResponse(content).body
+
+
+def _fast(model, docs):
+    return ORJSONResponse(shape(docs, model)).body
+
+
+def _time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def run(sizes, repeat):
+    for model, make in ((SongModel, _song), (AlbumModel, _album), (PlaylistModel, _playlist)):
+        field = create_response_field(name=f"Response_{model.__name__}", type_=list[model])
+        for size in sizes:
+            docs = [make(i) for i in range(size)]
+            default_ms = _time(lambda: _default(field, docs), repeat)
+            fast_ms = _time(lambda: _fast(model, docs), repeat)
+            print(f"{model.__name__:>14} {size:>7}: default {default_ms:8.1f} ms  fast {fast_ms:8.1f} ms  "
+                  f"x{default_ms / fast_ms:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
@@ -0,0 +1,52 @@
+import argparse
+
+from config.db import conn
+from config.indexes import ensure_indexes, index_report
+import service.album
+import service.artist
+import service.playlist
+import service.song
+from utils import search
+
+
+def reindex_search(args):
+    collections = [
+        (conn.songs, service.song.SEARCH_FIELDS),
+        (conn.albums, service.album.SEARCH_FIELDS),
+        (conn.artists, service.artist.SEARCH_FIELDS),
+        (conn.playlists, service.playlist.SEARCH_FIELDS),
+    ]
+    for collection, fields in collections:
+        count = search.reindex(collection, fields)
+        print(f"{collection.name}: {count} documents reindexed")
+
+
+def backfill_artists(args):
+    count = service.artist.refresh_denormalized()
+    print(f"{count} songs and albums updated")
+
+
+def create_indexes(args):
+    for collection, names in ensure_indexes(conn).items():
+        print(f"{collection}: {', '.join(names)}")
+
+
+def show_index_report(args):
+    for collection, report in index_report(conn).items():
+        print(f"{collection}: missing={report['missing']} extra={report['extra']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for the songs backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("reindex-search", help="Rebuild the search keys of every searchable document") \
+        .set_defaults(func=reindex_search)
+    commands.add_parser("backfill-artists", help="Recompute artist names and subscription level on songs and albums") \
+        .set_defaults(func=backfill_artists)
+    commands.add_parser("ensure-indexes", help="Create every index declared in config/indexes.py") \
+        .set_defaults(func=create_indexes)
+    commands.add_parser("index-report", help="Compare declared indexes against the live database") \
+        .set_defaults(func=show_index_report)
+
+    arguments = parser.parse_args()
+    arguments.func(arguments)
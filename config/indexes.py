@@ -0,0 +1,66 @@
+import logging
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from utils.search import KEYS_FIELD
+
+logger = logging.getLogger('main-logger')
+
+INDEXES = {
+    "artists": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_1"),
+        IndexModel([(KEYS_FIELD, ASCENDING)], name=f"{KEYS_FIELD}_1"),
+    ],
+    "subscriptions": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_1"),
+    ],
+    "subscription_invalidations": [
+        IndexModel([("at", ASCENDING)], name="at_1", expireAfterSeconds=3600),
+    ],
+    "songs": [
+        IndexModel([("artists", ASCENDING)], name="artists_1"),
+        IndexModel([("status", ASCENDING)], name="status_1"),
+        IndexModel([(KEYS_FIELD, ASCENDING)], name=f"{KEYS_FIELD}_1"),
+    ],
+    "albums": [
+        IndexModel([("artists", ASCENDING)], name="artists_1"),
+        IndexModel([(KEYS_FIELD, ASCENDING)], name=f"{KEYS_FIELD}_1"),
+    ],
+    "payments_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_1_next_attempt_at_1"),
+        IndexModel([("claim", ASCENDING)], name="claim_1", sparse=True),
+    ],
+    "plays": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_1", expireAfterSeconds=0),
+    ],
+    "playlists": [
+        IndexModel([("owner", ASCENDING)], name="owner_1"),
+        IndexModel([(KEYS_FIELD, ASCENDING)], name=f"{KEYS_FIELD}_1"),
+    ],
+}
+
+
+def ensure_indexes(db, catalog: dict = None) -> dict:
+    """Creates the declared indexes of each collection, a collection that fails is logged and does not stop the rest.
+
+    Connection errors are raised, they would fail every collection the same way.
+    """
+    catalog = catalog or INDEXES
+    created = {}
+    for collection, indexes in catalog.items():
+        try:
+            created[collection] = db[collection].create_indexes(indexes)
+        except OperationFailure:
+            logger.exception(f"Could not create indexes on {collection}")
+    return created
+
+
+def index_report(db, catalog: dict = None) -> dict:
+    catalog = catalog or INDEXES
+    report = {}
+    for collection, indexes in catalog.items():
+        declared = {index.document["name"] for index in indexes}
+        live = {index["name"] for index in db[collection].list_indexes()} - {"_id_"}
+        report[collection] = {"missing": sorted(declared - live), "extra": sorted(live - declared)}
+    return report
@@ -1,20 +1,74 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import os
+from urllib.parse import quote
+
+# Signed URLs point to a local route that is only registered outside production
+_SIGNING_KEY = os.urandom(16)
+
+
+def _signature(name: str, expires: int) -> str:
+    return hmac.new(_SIGNING_KEY, f"{name}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def verify_signature(name: str, expires: int, signature: str) -> bool:
+    valid = hmac.compare_digest(_signature(name, expires), signature)
+    return valid and expires >= datetime.datetime.utcnow().timestamp()
+
+
 class BlobMock:
-    c = ""
+    c = b""
+    md5_hash = None
+    name = None
 
     def upload_from_string(self, c):
-        self.c = c
+        self.c = c.encode() if isinstance(c, str) else c
+        self.md5_hash = base64.b64encode(hashlib.md5(self.c).digest()).decode()
+        return
+
+    def upload_from_file(self, f, size=None, content_type=None, checksum=None):
+        self.upload_from_string(f.read() if size is None else f.read(size))
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.c)
+
+    def reload(self):
         return
 
+    def delete(self):
+        self.c = b""
+        self.md5_hash = None
+
     def download_as_string(self):
         return self.c
 
+    def download_as_bytes(self, start=None, end=None):
+        start = start or 0
+        end = len(self.c) - 1 if end is None else end
+        return self.c[start:end + 1]
+
+    def generate_signed_url(self, expiration, method="GET", version=None, response_type=None):
+        expires = int((datetime.datetime.utcnow() + expiration).timestamp())
+        return f"/mock-bucket/{quote(self.name)}?expires={expires}&signature={_signature(self.name, expires)}"
+
+    @property
+    def size(self):
+        return len(self.c)
+
 
 class BucketMock:
     d = dict()
 
-    def blob(self, s):
+    def blob(self, s, chunk_size=None):
         if s in self.d:
             return self.d[s]
         b = BlobMock()
+        b.name = s
         self.d[s] = b
         return b
+
+    def get_blob(self, s):
+        return self.d.get(s)
@@ -9,3 +9,25 @@ class ContentNotFound(HTTPException):
 class ContentForbidden(HTTPException):
     def __init__(self, song_id: str, user_id: str):
         super().__init__(status.HTTP_403_FORBIDDEN, f"Cannot download content for Song:{song_id} for User:{user_id}.")
+
+
+class RangeNotSatisfiable(HTTPException):
+    def __init__(self, size: int):
+        super().__init__(status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, "Requested range not satisfiable",
+                         {"content-range": f"bytes */{size}"})
+
+
+class ContentTooLarge(HTTPException):
+    def __init__(self, max_size: int):
+        super().__init__(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"Content is larger than {max_size} bytes", None)
+
+
+class ContentChecksumMismatch(HTTPException):
+    def __init__(self, song_id: str):
+        super().__init__(status.HTTP_502_BAD_GATEWAY, f"Stored content for Song {song_id} failed checksum verification",
+                         None)
+
+
+class SeekNotSupported(HTTPException):
+    def __init__(self, song_id: str):
+        super().__init__(status.HTTP_400_BAD_REQUEST, f"Content of Song {song_id} has no seek index", None)
@@ -14,3 +14,12 @@ class SongNotAvailable(HTTPException):
 class SongNotOwnedByUser(HTTPException):
     def __init__(self, song_id: str, user_id: str):
         super().__init__(status.HTTP_400_BAD_REQUEST, f"The owner of song {song_id} is not {user_id}", None)
+
+
+class InvalidSongs(HTTPException):
+    def __init__(self, errors: dict):
+        first = next(iter(errors.values()))
+        super().__init__(first.status_code, [
+            {"song_id": song_id, "status_code": error.status_code, "detail": error.detail}
+            for song_id, error in errors.items()
+        ], None)
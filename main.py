@@ -1,19 +1,34 @@
+import asyncio
+import logging
+
 import uvicorn
 from fastapi import FastAPI, Response
+from pymongo.errors import PyMongoError
 from fastapi.middleware.cors import CORSMiddleware
 
 from docs import tags_metadata
 from logging.config import dictConfig
 from config.log_conf import log_config
+from config.db import conn, test
+from config.indexes import ensure_indexes
 
 from routes.song import song_routes
 from routes.content import content_routes
 from routes.artist import artist_routes
 from routes.album import album_routes
 from routes.playlist import playlist_routes
+from routes.subscription import subscription_routes
+from routes.mock_bucket import mock_bucket_routes
+import service.artist
+import service.content
+import service.payment
+import service.subscription
+from utils.utils import NEXT_CURSOR_HEADER, MISSING_IDS_HEADER
+import utils.user
 
 
 dictConfig(log_config)
+logger = logging.getLogger('main-logger')
 app = FastAPI(
     title="Songs backend for Spotifiuby",
     description="REST API using FastAPI, MongoDB and Firebase",
@@ -32,6 +47,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, MISSING_IDS_HEADER],
 )
 
 
@@ -40,6 +56,30 @@ app.include_router(content_routes)
 app.include_router(artist_routes)
 app.include_router(album_routes)
 app.include_router(playlist_routes)
+app.include_router(subscription_routes)
+if test:
+    app.include_router(mock_bucket_routes)
+
+
+@app.on_event("startup")
+def create_indexes():
+    try:
+        ensure_indexes(conn)
+    except PyMongoError:
+        logger.exception("Could not create indexes")
+
+
+@app.on_event("startup")
+async def start_payment_dispatcher():
+    if service.payment.PAYMENTS_ENABLED:
+        app.state.payment_dispatcher = asyncio.create_task(service.payment.dispatch_forever())
+
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    if getattr(app.state, "payment_dispatcher", None):
+        app.state.payment_dispatcher.cancel()
+    await utils.user.close_client()
 
 
 @app.get("/", include_in_schema=False)
@@ -47,5 +87,15 @@ def ping():
     return Response(status_code=200)
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return {
+        "artist_cache": service.artist.cache_info(),
+        "subscription_cache": service.subscription.cache_info(),
+        "content_cache": service.content.cache_info(),
+        "admin_cache": utils.user.cache_info()
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host='0.0.0.0', port=8000, reload=True)
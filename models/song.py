@@ -18,6 +18,8 @@ class SongModel(BaseModel):
     status: StatusEnum
     date_created: datetime.datetime
     date_uploaded: Union[datetime.datetime, None]
+    duration: Optional[float]
+    bitrate: Optional[int]
 
     @staticmethod
     def is_active(song: dict):
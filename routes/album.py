@@ -1,11 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Header, Depends, Response
+from fastapi import APIRouter, HTTPException, status, Header, Depends, Response, Query
 from typing import Optional
 
 from models.album import AlbumModel, CreateAlbumRequest, UpdateAlbumRequest
 from models.song import SongModel
 import service.album
 import service.artist
-from utils.utils import log_request_body, validate_song, check_valid_album_id, check_valid_artist_id, verify_api_key, get_user_subscription
+from utils.utils import log_request_body, validate_song, validate_songs, check_valid_album_id, check_valid_artist_id, verify_api_key, get_user_subscription, \
+    decode_cursor, set_next_cursor, check_not_modified, etag, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.executor import run_blocking
+from utils.ndjson import accepts_ndjson, ndjson_response
+from utils.fast_json import list_response
 
 album_routes = APIRouter()
 
@@ -14,16 +18,26 @@ album_routes = APIRouter()
 async def get_albums(response: Response,
                      q: Optional[str] = None,
                      artist_id: Optional[str] = None,
+                     limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                     cursor: Optional[str] = None,
+                     accept: Optional[str] = Header(None),
                      x_user_id: Optional[str] = Header(None),
                      x_api_key: Optional[str] = Header(None),
                      authorization: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    albums = service.album.find(q, artist_id, subscription_level=get_user_subscription(x_user_id))
-    for album in albums:
-        album['artists'] = [service.artist.get_name(artist_id) for artist_id in album['artists']]
-    return albums
+    subscription_level = await run_blocking(get_user_subscription, x_user_id)
+    if accepts_ndjson(accept):
+        albums = service.album.stream(q, artist_id, subscription_level=subscription_level,
+                                      after=decode_cursor(cursor), limit=limit)
+        return ndjson_response(albums, AlbumModel, prepare=service.artist.fill_names, headers=response.headers)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    albums = await run_blocking(service.album.find, q, artist_id, subscription_level=subscription_level,
+                                after=decode_cursor(cursor), limit=limit)
+    set_next_cursor(response, albums, limit)
+    return list_response(await run_blocking(service.artist.fill_names, albums), AlbumModel, response)
 
 
 @album_routes.get("/albums/{album_id}", response_model=AlbumModel, tags=["Albums"], status_code=status.HTTP_200_OK)
@@ -31,15 +45,18 @@ async def get_album(response: Response,
                     album_id: str = Depends(check_valid_album_id),
                     x_user_id: Optional[str] = Header(None),
                     x_api_key: Optional[str] = Header(None),
-                    authorization: Optional[str] = Header(None)):
+                    authorization: Optional[str] = Header(None),
+                    if_none_match: Optional[str] = Header(None),
+                    if_modified_since: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    album = service.album.get(album_id)
+    album = await run_blocking(service.album.get, album_id)
     if album is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
-    album['artists'] = [service.artist.get_name(artist_id) for artist_id in album['artists']]
-    return album
+    await run_blocking(service.artist.fill_names, [album])
+    return check_not_modified(response, if_none_match, if_modified_since, etag(AlbumModel(**album).json()),
+                              album.get("updated_at")) or album
 
 
 @album_routes.get("/albums/{album_id}/songs", response_model=list[SongModel], tags=["Albums"], status_code=status.HTTP_200_OK)
@@ -52,14 +69,12 @@ async def get_album_songs(response: Response,
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_album_id(album_id)
-    album_songs = service.album.get_songs(album_id, get_user_subscription(x_user_id))
+    subscription_level = await run_blocking(get_user_subscription, x_user_id)
+    album_songs = await run_blocking(service.album.get_songs, album_id, subscription_level)
     if album_songs is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
 
-    for song in album_songs:
-        song['artists'] = [service.artist.get_name(artist_id) for artist_id in song['artists']]
-
-    return album_songs
+    return list_response(await run_blocking(service.artist.fill_names, album_songs), SongModel, response)
 
 
 @album_routes.post("/albums", response_model=AlbumModel, tags=["Albums"], status_code=status.HTTP_201_CREATED)
@@ -72,11 +87,10 @@ async def create_album(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    for song in album.songs:
-        validate_song(song)
+    await run_blocking(validate_songs, album.songs)
     log_request_body(x_request_id, album)
 
-    return service.album.create(album)
+    return await run_blocking(service.album.create, album)
 
 
 @album_routes.put("/albums/{album_id}/songs", response_model=AlbumModel, tags=["Albums"])
@@ -91,7 +105,7 @@ async def add_song(response:  Response,
     verify_api_key(x_api_key)
     log_request_body(x_request_id, {"song": song_id})
 
-    updated_album = service.album.add_song(album_id, song_id)
+    updated_album = await run_blocking(service.album.add_song, album_id, song_id)
     if not updated_album:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
 
@@ -113,7 +127,7 @@ async def add_artist(response: Response,
     check_valid_artist_id(artist_id)
     log_request_body(x_request_id, {"artist_id": artist_id})
 
-    updated_album = service.album.add_artist(album_id, artist_id)
+    updated_album = await run_blocking(service.album.add_artist, album_id, artist_id)
     if not updated_album:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
 
@@ -132,11 +146,10 @@ async def update_album(response: Response,
     verify_api_key(x_api_key)
     check_valid_album_id(album_id)
     if album.songs:
-        for song in album.songs:
-            validate_song(song)
+        await run_blocking(validate_songs, album.songs)
     log_request_body(x_request_id, album)
 
-    updated_album = service.album.update(album_id, album)
+    updated_album = await run_blocking(service.album.update, album_id, album)
     if not updated_album:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
 
@@ -152,6 +165,6 @@ async def delete_album(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    r = service.album.delete(album_id)
+    r = await run_blocking(service.album.delete, album_id)
     if not r:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Album {album_id} not found")
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, Header, Depends, Response
+from fastapi import APIRouter, HTTPException, status, Header, Depends, Response, Query
 from typing import Optional
 
-from utils.utils import log_request_body, check_valid_artist_id, verify_api_key
+from utils.utils import log_request_body, check_valid_artist_id, verify_api_key, decode_cursor, set_next_cursor, \
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from models.artist import ArtistModel, CreateArtistRequest, UpdateArtistRequest
 import service.artist
+from utils.executor import run_blocking
+from utils.fast_json import list_response
 
 artist_routes = APIRouter()
 
@@ -11,13 +14,17 @@ artist_routes = APIRouter()
 @artist_routes.get("/artists", response_model=list[ArtistModel], tags=["Artists"], status_code=status.HTTP_200_OK)
 async def get_artists(response: Response,
                       q: Optional[str] = None,
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None,
                       x_user_id: Optional[str] = Header(None),
                       x_api_key: Optional[str] = Header(None),
                       authorization: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    return service.artist.find(q)
+    artists = await run_blocking(service.artist.find, q, after=decode_cursor(cursor), limit=limit)
+    set_next_cursor(response, artists, limit)
+    return list_response(artists, ArtistModel, response)
 
 
 @artist_routes.get("/artists/{artist_id}", response_model=ArtistModel, tags=["Artists"], status_code=status.HTTP_200_OK)
@@ -29,7 +36,7 @@ async def get_artist(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    artist = service.artist.get(artist_id)
+    artist = await run_blocking(service.artist.get, artist_id)
     if artist is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Artist {artist_id} not found")
 
@@ -50,7 +57,7 @@ async def create_artist(response: Response,
     if not x_user_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="x_user_id is missing")
-    return service.artist.create(artist.name, artist.subscription_level, x_user_id)
+    return await run_blocking(service.artist.create, artist.name, artist.subscription_level, x_user_id)
 
 
 @artist_routes.put("/artists/{artist_id}", response_model=ArtistModel, tags=["Artists"])
@@ -65,9 +72,9 @@ async def update_artist(response: Response,
         response.headers['authorization'] = authorization
     log_request_body(x_request_id, artist)
     verify_api_key(x_api_key)
-    updated_artist = service.artist.update(artist_id,
-                                           name=artist.name,
-                                           subscription_level=artist.subscription_level)
+    updated_artist = await run_blocking(service.artist.update, artist_id,
+                                        name=artist.name,
+                                        subscription_level=artist.subscription_level)
     if not updated_artist:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Artist {artist_id} not found")
     return updated_artist
@@ -82,7 +89,7 @@ async def delete_artist(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    r = service.artist.delete(artist_id)
+    r = await run_blocking(service.artist.delete, artist_id)
     if not r:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Artist {artist_id} not found")
 
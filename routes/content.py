@@ -1,50 +1,107 @@
-from fastapi import APIRouter, Response, UploadFile, status, Depends, Header
+from fastapi import APIRouter, Request, Response, UploadFile, status, Depends, Header, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.routing import APIRoute
 from typing import Optional
 
-from exceptions.content_exceptions import ContentNotFound
-from service.content import get_song_content, upload_song_content, verify_download
+from exceptions.content_exceptions import ContentNotFound, ContentForbidden, ContentTooLarge
+from service.content import get_song_content_blob, read_song_content, upload_song_content, can_download, \
+    cache_writer, cache_served, get_signed_url, should_redirect, seek_range, CachedContent, CHUNK_SIZE
+import service.content
+import service.payment
 import service.song
-import service.artist
-from utils.utils import validate_song, verify_api_key, log_request_body
-import requests
-import os
+from utils.utils import validate_song, get_valid_song, check_valid_song_id, check_not_modified, verify_api_key, \
+    log_request_body, parse_range
+from utils.executor import run_blocking
+from utils.user import is_admin
 
-content_routes = APIRouter()
+# Room for the multipart boundaries and part headers around the file
+_FORM_OVERHEAD = 64 * 1024
+
+
+class _UploadLimitRoute(APIRoute):
+    """Rejects a body declared larger than MAX_UPLOAD_SIZE before it is read, the upload still checks the actual size."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def check_length(request: Request) -> Response:
+            length = request.headers.get('content-length', '')
+            if length.isdigit() and int(length) > service.content.MAX_UPLOAD_SIZE + _FORM_OVERHEAD:
+                raise ContentTooLarge(service.content.MAX_UPLOAD_SIZE)
+            return await handler(request)
+
+        return check_length
+
+
+content_routes = APIRouter(route_class=_UploadLimitRoute)
+
+
+async def _stream_content(blob, start: int, end: int, writer=None):
+    try:
+        while start <= end:
+            chunk = await run_blocking(read_song_content, blob, start, min(start + CHUNK_SIZE, end + 1) - 1)
+            if not chunk:
+                return
+            if writer:
+                await run_blocking(writer.write, chunk)
+            start += len(chunk)
+            yield chunk
+        if writer:
+            await run_blocking(writer.commit, blob.size)
+    finally:
+        # A client that disconnects or a short read leaves the entry uncommitted
+        if writer:
+            writer.close()
+        if isinstance(blob, CachedContent):
+            blob.close()
 
 
 @content_routes.get("/songs/{song_id}/content", response_class=Response, tags=["Content"])
 async def get_content(response: Response,
-                      song_id: str = Depends(validate_song),
+                      song_id: str = Depends(check_valid_song_id),
                       authorization: Optional[str] = Header(None),
                       x_user_id: Optional[str] = Header(None),
                       x_api_key: Optional[str] = Header(None),
-                      x_request_id: Optional[str] = Header(None)):
-
-    contents = get_song_content(song_id)
-    if contents:
-
-        song = service.song.get(song_id)
-        if song and os.getenv("CURRENT_ENVIRONMENT") == "production":
-            for artist_id in song['artists']:
-                artist = service.artist.get(artist_id)
-                user_id = artist['user_id']
-                if artist['subscription_level'] == 1:
-                    price = "0.00000005"
-                elif artist['subscription_level'] == 2:
-                    price = "0.0000001"
-                elif artist['subscription_level'] == 3:
-                    price = "0.00000015"
-                else:
-                    continue
-                rBody = {
-                    "artistId": user_id,
-                    "amountInEthers": price,
-                    }
-                r = requests.post("https://spotifiuby-payment-service.herokuapp.com/payment", json=rBody)
-        return Response(media_type="audio/mpeg", content=contents)
-    else:
+                      x_request_id: Optional[str] = Header(None),
+                      range_header: Optional[str] = Header(None, alias="range"),
+                      if_none_match: Optional[str] = Header(None),
+                      if_modified_since: Optional[str] = Header(None),
+                      redirect: Optional[bool] = None,
+                      start_seconds: Optional[float] = Query(None, alias="start", ge=0)):
+    song = await run_blocking(get_valid_song, song_id)
+    if not await run_blocking(can_download, x_user_id, song) and not await is_admin(x_user_id, authorization):
+        raise ContentForbidden(song_id, x_user_id)
+    content_hash = song.get("content_hash")
+    not_modified = check_not_modified(response, if_none_match, if_modified_since,
+                                      f'"{content_hash}"' if content_hash else None, song.get("updated_at"))
+    if not_modified:
+        return not_modified
+
+    blob = await run_blocking(get_song_content_blob, song)
+    if not blob:
         raise ContentNotFound(song_id)
 
+    byte_range = parse_range(range_header, blob.size)
+    if not byte_range and start_seconds:
+        byte_range = seek_range(song, start_seconds, blob.size)
+    start, end = byte_range or (0, blob.size - 1)
+    headers = {**response.headers, "accept-ranges": "bytes", "content-length": str(end - start + 1)}
+    if byte_range:
+        headers["content-range"] = f"bytes {start}-{end}/{blob.size}"
+    await run_blocking(service.payment.charge_play, x_user_id, song)
+    if should_redirect(blob.size, redirect):
+        url = await run_blocking(get_signed_url, song)
+        return RedirectResponse(url, status_code=status.HTTP_302_FOUND, headers=dict(response.headers))
+
+    writer = None
+    if isinstance(blob, CachedContent):
+        cache_served(end - start + 1)
+    elif not byte_range:
+        # Only full downloads fill the cache, from the same chunks, so a miss reads the bucket once
+        writer = cache_writer(song, blob)
+    return StreamingResponse(_stream_content(blob, start, end, writer), media_type="audio/mpeg", headers=headers,
+                             status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK)
+
 
 @content_routes.post("/songs/{song_id}/content", response_class=Response, tags=["Content"])
 async def post_content(response: Response,
@@ -58,6 +115,6 @@ async def post_content(response: Response,
         response.headers['authorization'] = authorization
     log_request_body(x_request_id, {'headers': {'authorization': authorization, 'x_api_key': x_api_key, 'x_user_id': x_user_id}})
     verify_api_key(x_api_key)
-    upload_song_content(song_id, await file.read())
-    service.song.activate_song(song_id)
+    content = await run_blocking(upload_song_content, song_id, file.file)
+    await run_blocking(service.song.activate_song, song_id, content)
     return Response(status_code=status.HTTP_201_CREATED)
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Response, status
+from fastapi import HTTPException
+
+from config.db import bucket
+from config.mock_mongo import verify_signature
+
+mock_bucket_routes = APIRouter()
+
+
+@mock_bucket_routes.get("/mock-bucket/{blob_name:path}", include_in_schema=False)
+def get_mock_blob(blob_name: str, expires: int, signature: str):
+    if not verify_signature(blob_name, expires, signature):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Signed URL not valid or expired")
+    blob = bucket.get_blob(blob_name)
+    if not blob:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Blob {blob_name} not found")
+    return Response(content=blob.download_as_bytes(), media_type="audio/mpeg")
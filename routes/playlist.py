@@ -1,32 +1,34 @@
-from fastapi import APIRouter, HTTPException, status, Header, Response
+from fastapi import APIRouter, HTTPException, status, Header, Response, Query
 from typing import Optional
 
 from models.playlist import PlaylistModel, CreatePlaylistRequest, UpdatePlaylistRequest, AddSongsPlaylistRequest
 from models.song import SongModel
 import service.playlist
 import service.artist
-from utils.utils import log_request_body, validate_song, verify_api_key, check_valid_playlist_id, get_user_subscription
-from exceptions.playlist_exceptions import PlaylistNotOwnedByUser
+import service.content
+from utils.utils import log_request_body, validate_songs, verify_api_key, check_valid_playlist_id, get_user_subscription, \
+    decode_cursor, set_next_cursor, check_not_modified, etag, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.executor import run_blocking
+from utils.fast_json import list_response
 
 
 playlist_routes = APIRouter()
 
 
-def _verify_ownership(playlist_id, user_id):
-    if not service.playlist.is_owner(playlist_id, user_id):
-        raise PlaylistNotOwnedByUser(playlist_id, user_id)
-
-
 @playlist_routes.get("/playlists", response_model=list[PlaylistModel], tags=["Playlists"], status_code=status.HTTP_200_OK)
 async def get_playlists(response: Response,
                         q: Optional[str] = None,
+                        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None,
                         x_user_id: Optional[str] = Header(None),
                         x_api_key: Optional[str] = Header(None),
                         authorization: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    return service.playlist.find(q)
+    playlists = await run_blocking(service.playlist.find, q, after=decode_cursor(cursor), limit=limit)
+    set_next_cursor(response, playlists, limit)
+    return list_response(playlists, PlaylistModel, response)
 
 
 @playlist_routes.get("/playlists/{playlist_id}", response_model=PlaylistModel, tags=["Playlists"], status_code=status.HTTP_200_OK)
@@ -34,16 +36,19 @@ async def get_playlist(response: Response,
                        playlist_id: str,
                        x_user_id: Optional[str] = Header(None),
                        x_api_key: Optional[str] = Header(None),
-                       authorization: Optional[str] = Header(None)):
+                       authorization: Optional[str] = Header(None),
+                       if_none_match: Optional[str] = Header(None),
+                       if_modified_since: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
-    playlist = service.playlist.get(playlist_id)
+    playlist = await run_blocking(service.playlist.get, playlist_id)
     if playlist is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
-    return playlist
+    return check_not_modified(response, if_none_match, if_modified_since, etag(PlaylistModel(**playlist).json()),
+                              playlist.get("updated_at")) or playlist
 
 
 @playlist_routes.get("/playlists/{playlist_id}/songs", response_model=list[SongModel], tags=["Playlists"], status_code=status.HTTP_200_OK)
@@ -56,14 +61,30 @@ async def get_playlist_songs(response: Response,
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
-    playlist_songs = service.playlist.get_songs(playlist_id, get_user_subscription(x_user_id))
+    subscription_level = await run_blocking(get_user_subscription, x_user_id)
+    playlist_songs = await run_blocking(service.playlist.get_songs, playlist_id, subscription_level)
     if playlist_songs is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
-    for song in playlist_songs:
-        song['artists'] = [service.artist.get_name(artist_id) for artist_id in song['artists']]
+    return list_response(await run_blocking(service.artist.fill_names, playlist_songs), SongModel, response)
+
+
+@playlist_routes.get("/playlists/{playlist_id}/entitlements", response_model=dict[str, bool], tags=["Playlists"],
+                     status_code=status.HTTP_200_OK)
+async def get_playlist_entitlements(response: Response,
+                                    playlist_id: str,
+                                    x_user_id: Optional[str] = Header(None),
+                                    x_api_key: Optional[str] = Header(None),
+                                    authorization: Optional[str] = Header(None)):
+    if authorization:
+        response.headers['authorization'] = authorization
+    verify_api_key(x_api_key)
+    check_valid_playlist_id(playlist_id)
+    entitlements = await run_blocking(service.content.get_playlist_entitlements, x_user_id, playlist_id)
+    if entitlements is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
-    return playlist_songs
+    return entitlements
 
 
 @playlist_routes.post("/playlists", response_model=PlaylistModel, tags=["Playlists"], status_code=status.HTTP_201_CREATED)
@@ -76,10 +97,9 @@ async def create_playlist(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    for song in playlist.songs:
-        validate_song(song)
+    await run_blocking(validate_songs, playlist.songs)
     log_request_body(x_request_id, playlist)
-    return service.playlist.create(playlist, x_user_id)
+    return await run_blocking(service.playlist.create, playlist, x_user_id)
 
 
 @playlist_routes.post("/playlists/{playlist_id}", response_model=PlaylistModel, tags=["Playlists"])
@@ -94,12 +114,10 @@ async def add_songs(response: Response,
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
-    _verify_ownership(playlist_id, x_user_id)
-    for song in songs.songs:
-        validate_song(song)
+    await run_blocking(validate_songs, songs.songs)
     log_request_body(x_request_id, songs)
 
-    updated_playlist = service.playlist.add_songs(playlist_id, songs.songs)
+    updated_playlist = await run_blocking(service.playlist.add_songs, playlist_id, songs.songs, x_user_id)
     if not updated_playlist:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
@@ -118,10 +136,9 @@ async def delete_song(response: Response,
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
-    _verify_ownership(playlist_id, x_user_id)
     log_request_body(x_request_id, song_id)
 
-    updated_playlist = service.playlist.delete_song(playlist_id, song_id)
+    updated_playlist = await run_blocking(service.playlist.delete_song, playlist_id, song_id, x_user_id)
     if not updated_playlist:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
@@ -141,11 +158,10 @@ async def update_playlist(response: Response,
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
     if playlist.songs:
-        for song in playlist.songs:
-            validate_song(song)
+        await run_blocking(validate_songs, playlist.songs)
     log_request_body(x_request_id, playlist)
 
-    updated_playlist = service.playlist.update(playlist_id, playlist)
+    updated_playlist = await run_blocking(service.playlist.update, playlist_id, playlist)
     if not updated_playlist:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
 
@@ -162,6 +178,6 @@ async def delete_playlist(response: Response,
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
     check_valid_playlist_id(playlist_id)
-    r = service.playlist.delete(playlist_id)
+    r = await run_blocking(service.playlist.delete, playlist_id)
     if not r:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Playlist {playlist_id} not found")
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, status, Header, Depends, Response
+from fastapi import APIRouter, HTTPException, status, Header, Depends, Response, Query, Body
 from typing import Optional
 
 from models.song import SongModel, CreateSongRequest, UpdateSongRequest
 import service.song
 import service.artist
-from utils.utils import log_request_body, check_valid_song_id, verify_api_key, get_user_subscription
+from utils.utils import log_request_body, check_valid_song_id, verify_api_key, get_user_subscription, decode_cursor, \
+    set_next_cursor, check_not_modified, etag, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_BATCH_SIZE, \
+    MISSING_IDS_HEADER
 from utils.user import is_admin
+from utils.executor import run_blocking
+from utils.ndjson import accepts_ndjson, ndjson_response
+from utils.fast_json import list_response
 from exceptions.song_exceptions import SongNotFound, SongNotOwnedByUser
 from exceptions.user_exceptions import MissingUserId
 
@@ -18,25 +23,60 @@ def _verify_user_id(user_id):
     return user_id
 
 
-def _verify_ownership(song_id, user_id):
-    if not service.song.is_owner(song_id, user_id) and not is_admin(user_id):
+async def _owned_write(write, song_id, user_id, authorization, *args):
+    # The write is scoped to the caller's artist, the song is only looked up again when it matched nothing
+    artist = await run_blocking(service.artist.get, user_id=user_id)
+    if artist:
+        result = await run_blocking(write, song_id, *args, artist_id=artist['id'])
+        if result:
+            return result
+    if not await run_blocking(service.song.exists, song_id):
+        raise SongNotFound(song_id)
+    if not await is_admin(user_id, authorization):
         raise SongNotOwnedByUser(song_id, user_id)
+    return await run_blocking(write, song_id, *args)
+
+
+async def _get_songs_by_ids(response: Response, ids: str, subscription_level: int):
+    songs_ids = list(dict.fromkeys(song_id.strip() for song_id in ids.split(",") if song_id.strip()))
+    if not songs_ids or len(songs_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Between 1 and {MAX_PAGE_SIZE} song ids are required")
+    for song_id in songs_ids:
+        check_valid_song_id(song_id)
+    songs, missing = await run_blocking(service.song.get_many, songs_ids, subscription_level)
+    if missing:
+        response.headers[MISSING_IDS_HEADER] = ",".join(missing)
+    return list_response(await run_blocking(service.artist.fill_names, songs), SongModel, response)
 
 
 @song_routes.get("/songs", response_model=list[SongModel], tags=["Songs"], status_code=status.HTTP_200_OK)
 async def get_songs(response: Response,
                     q: Optional[str] = None,
+                    ids: Optional[str] = None,
                     artist_id: Optional[str] = None,
+                    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: Optional[str] = None,
+                    accept: Optional[str] = Header(None),
                     x_user_id: Optional[str] = Header(None),
                     x_api_key: Optional[str] = Header(None),
                     authorization: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    songs = service.song.find(q, artist_id, subscription_level=get_user_subscription(x_user_id))
-    for song in songs:
-        song['artists'] = [service.artist.get_name(artist_id) for artist_id in song['artists']]
-    return songs
+    subscription_level = await run_blocking(get_user_subscription, x_user_id)
+    if ids is not None:
+        return await _get_songs_by_ids(response, ids, subscription_level)
+    if accepts_ndjson(accept):
+        songs = service.song.stream(q, artist_id, subscription_level=subscription_level,
+                                    after=decode_cursor(cursor), limit=limit)
+        return ndjson_response(songs, SongModel, prepare=service.artist.fill_names, headers=response.headers)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    songs = await run_blocking(service.song.find, q, artist_id, subscription_level=subscription_level,
+                               after=decode_cursor(cursor), limit=limit)
+    set_next_cursor(response, songs, limit)
+    return list_response(await run_blocking(service.artist.fill_names, songs), SongModel, response)
 
 
 @song_routes.get("/songs/{song_id}", response_model=SongModel, tags=["Songs"], status_code=status.HTTP_200_OK)
@@ -44,15 +84,18 @@ async def get_song(response: Response,
                    song_id: str = Depends(check_valid_song_id),
                    x_user_id: Optional[str] = Header(None),
                    x_api_key: Optional[str] = Header(None),
-                   authorization: Optional[str] = Header(None)):
+                   authorization: Optional[str] = Header(None),
+                   if_none_match: Optional[str] = Header(None),
+                   if_modified_since: Optional[str] = Header(None)):
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    song = service.song.get(song_id)
+    song = await run_blocking(service.song.get, song_id)
     if song is None:
         raise SongNotFound(song_id)
-    song['artists'] = [service.artist.get_name(artist_id) for artist_id in song['artists']]
-    return song
+    await run_blocking(service.artist.fill_names, [song])
+    return check_not_modified(response, if_none_match, if_modified_since, etag(SongModel(**song).json()),
+                              song.get("updated_at")) or song
 
 
 @song_routes.post("/songs", response_model=SongModel, tags=["Songs"], status_code=status.HTTP_201_CREATED)
@@ -67,7 +110,22 @@ async def create_song(response: Response,
     log_request_body(x_request_id, song)
     verify_api_key(x_api_key)
     _verify_user_id(x_user_id)
-    return service.song.create(song, x_user_id)
+    return await run_blocking(service.song.create, song, x_user_id)
+
+
+@song_routes.post("/songs/batch", response_model=list[SongModel], tags=["Songs"], status_code=status.HTTP_201_CREATED)
+async def create_songs(response: Response,
+                       songs: list[CreateSongRequest] = Body(..., min_items=1, max_items=MAX_BATCH_SIZE),
+                       x_user_id: Optional[str] = Header(None),
+                       x_api_key: Optional[str] = Header(None),
+                       authorization: Optional[str] = Header(None),
+                       x_request_id: Optional[str] = Header(None)):
+    if authorization:
+        response.headers['authorization'] = authorization
+    log_request_body(x_request_id, songs)
+    verify_api_key(x_api_key)
+    _verify_user_id(x_user_id)
+    return await run_blocking(service.song.create_many, songs, x_user_id)
 
 
 @song_routes.put("/songs/{song_id}", response_model=SongModel, tags=["Songs"])
@@ -82,8 +140,7 @@ async def update_song(response: Response,
         response.headers['authorization'] = authorization
     log_request_body(x_request_id, song)
     verify_api_key(x_api_key)
-    _verify_ownership(song_id, x_user_id)
-    updated_song = service.song.update(song_id, song)
+    updated_song = await _owned_write(service.song.update, song_id, x_user_id, authorization, song)
     if not updated_song:
         raise SongNotFound(song_id)
 
@@ -99,7 +156,5 @@ async def delete_song(response: Response,
     if authorization:
         response.headers['authorization'] = authorization
     verify_api_key(x_api_key)
-    _verify_ownership(song_id, x_user_id)
-    r = service.song.delete(song_id)
-    if not r:
-        SongNotFound(song_id)
+    if not await _owned_write(service.song.delete, song_id, x_user_id, authorization):
+        raise SongNotFound(song_id)
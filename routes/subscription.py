@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Response, status, Header
+from typing import Optional
+
+import service.subscription
+from utils.utils import verify_api_key
+from utils.executor import run_blocking
+
+subscription_routes = APIRouter()
+
+
+@subscription_routes.delete("/subscriptions/{user_id}/cache", tags=["Subscriptions"],
+                            status_code=status.HTTP_204_NO_CONTENT)
+async def invalidate_subscription(user_id: str,
+                                  x_api_key: Optional[str] = Header(None)):
+    verify_api_key(x_api_key)
+    await run_blocking(service.subscription.invalidate, user_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -3,59 +3,55 @@ import pymongo
 import datetime
 
 from config.db import conn
+import service.artist
 import service.song
+from utils import search
+from utils.dates import to_millis
 
 
 def _album_entity(album) -> dict:
     if not album:
         return album
     album['id'] = str(album.pop('_id'))
+    album.pop(search.KEYS_FIELD, None)
     album['artists'] = [str(artist_id) for artist_id in album['artists']]
     album['songs'] = [str(song_id) for song_id in album['songs']]
     return album
 
 
-def _regex_query(field, q):
-    return {field: {'$regex': q, '$options': 'i'}}
+SEARCH_FIELDS = ['name']
 
 
-def find(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None):
+def find(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+         after=None, limit: int = None):
+    return list(stream(q, artist_id, songs_ids, subscription_level, after, limit))
+
+
+def _pipeline(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+              after=None, limit: int = None) -> list:
+    q = search.query(q)
     mongo_query = {}
     if q:
-        fields = ['name', 'artists_names']
-        mongo_query = {'$or': [_regex_query(field, q) for field in fields]}
+        mongo_query = {'$or': [search.match(q), {'artists': {'$in': service.artist.search_ids(q)}}]}
     if artist_id:
         mongo_query['artists'] = ObjectId(artist_id)
-    if subscription_level is not None:
-        mongo_query['subscription_level'] = {'$lte': subscription_level}
     if songs_ids:
         mongo_query['_id'] = {'$in': [ObjectId(song_id) for song_id in songs_ids]}
+    if subscription_level is not None:
+        mongo_query['subscription_level'] = {'$not': {'$gt': subscription_level}}
+
+    pipeline = [{'$match': mongo_query}, *search.sort_stages(q, after)]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$unset': search.KEYS_FIELD})
+    return pipeline
+
 
-    pipeline = [
-        {
-            '$lookup': {
-                'from': 'artists',
-                'localField': 'artists',
-                'foreignField': '_id',
-                'as': 'artists_data'
-            }
-        }, {
-            '$addFields': {
-                'subscription_level': {
-                    '$max': '$artists_data.subscription_level'
-                },
-                'artists_names': '$artists_data.name'
-            }
-        }, {
-            '$match': mongo_query
-        }, {
-            '$unset': [
-                'artists_data', 'artists_names', 'subscription_level'
-            ]
-        }
-    ]
-
-    return [_album_entity(song) for song in conn.albums.aggregate(pipeline)]
+def stream(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+           after=None, limit: int = None):
+    pipeline = _pipeline(q, artist_id, songs_ids, subscription_level, after, limit)
+    for album in conn.albums.aggregate(pipeline):
+        yield _album_entity(album)
 
 
 def get(album_id: str):
@@ -74,21 +70,23 @@ def get_songs(album_id: str, subscription_level: int):
 
 def create(album):
     album_dict = album.dict()
-    album_dict["date_created"] = datetime.datetime.today()
+    album_dict["date_created"] = to_millis(datetime.datetime.today())
+    album_dict["updated_at"] = to_millis(datetime.datetime.utcnow())
     album_dict["songs"] = [ObjectId(song_id) for song_id in album_dict["songs"]]
     album_dict["artists"] = [ObjectId(a) for a in album_dict["artists"]]
+    album_dict.update(service.artist.denormalize(album_dict["artists"]))
     if "cover" not in album_dict:
         album_dict["cover"] = None
-    r = conn.albums.insert_one(album_dict)
-    mongo_album = conn.albums.find_one({"_id": r.inserted_id})
+    album_dict[search.KEYS_FIELD] = search.document_keys(album_dict, SEARCH_FIELDS)
+    conn.albums.insert_one(album_dict)
 
-    return _album_entity(mongo_album)
+    return _album_entity(album_dict)
 
 
 def add_song(album_id, song_id):
     updated_album = conn.albums.find_one_and_update(
         {"_id": ObjectId(album_id)},
-        {"$push": {"songs": song_id}},
+        {"$push": {"songs": song_id}, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
     return _album_entity(updated_album)
@@ -97,9 +95,13 @@ def add_song(album_id, song_id):
 def add_artist(album_id, artist_id):
     updated_album = conn.albums.find_one_and_update(
         {"_id": ObjectId(album_id)},
-        {"$push": {"artists": artist_id}},
+        {"$push": {"artists": artist_id}, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
+    if updated_album:
+        denormalized = service.artist.denormalize(updated_album["artists"])
+        conn.albums.update_one({"_id": updated_album["_id"]}, {"$set": denormalized})
+        updated_album.update(denormalized)
     return _album_entity(updated_album)
 
 
@@ -107,11 +109,14 @@ def update(album_id, album):
     to_update = {k: v for k, v in album.dict().items() if v is not None}
     if "artists" in to_update:
         to_update["artists"] = [ObjectId(artist_id) for artist_id in to_update["artists"]]
+        to_update.update(service.artist.denormalize(to_update["artists"]))
     if "songs" in to_update:
         to_update["songs"] = [ObjectId(song_id) for song_id in to_update["songs"]]
+    if "name" in to_update:
+        to_update[search.KEYS_FIELD] = search.document_keys(to_update, SEARCH_FIELDS)
     updated_album = conn.albums.find_one_and_update(
         {"_id": ObjectId(album_id)},
-        {"$set": to_update},
+        {"$set": to_update, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
     return _album_entity(updated_album)
@@ -1,44 +1,150 @@
 from bson import ObjectId
 import pymongo
+from pymongo import UpdateOne
 import datetime
+import os
 
 from config.db import conn
+from utils import search
+from utils.dates import to_millis
+from utils.cache import Cache
 from utils.utils import check_valid_artist_id
 
+SEARCH_FIELDS = ['name']
+
+# Each worker keeps its own copy, so the TTL bounds how stale other workers can get after a write
+_cache = Cache(maxsize=int(os.getenv('ARTIST_CACHE_SIZE', 1024)), ttl=float(os.getenv('ARTIST_CACHE_TTL', 60)))
+
 
 def _artist_entity(artist) -> dict:
     if not artist:
         return artist
     artist["id"] = str(artist.pop("_id"))
+    artist.pop(search.KEYS_FIELD, None)
     return artist
 
 
-def _regex_query(field, q):
-    return {field: {'$regex': q, '$options': 'i'}}
+def _cache_set(artist):
+    if artist:
+        _cache.set(('id', artist['id']), artist.copy())
+        _cache.set(('user', artist['user_id']), artist.copy())
+    return artist
 
 
-def find(q):
-    if not q:
-        mongo_query = {}
-    else:
-        fields = ['name']
-        mongo_query = {'$or': [_regex_query(field, q) for field in fields]}
-    return [_artist_entity(artist) for artist in conn.artists.find(mongo_query)]
+def _cache_delete(artist):
+    if artist:
+        _cache.delete(('id', artist['id']), ('user', artist['user_id']))
+
+
+def cache_info() -> dict:
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def find(q, after=None, limit: int = None):
+    q = search.query(q)
+    mongo_query = search.match(q) if q else {}
+    pipeline = [{'$match': mongo_query}, *search.sort_stages(q, after)]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$unset': search.KEYS_FIELD})
+    return [_artist_entity(artist) for artist in conn.artists.aggregate(pipeline)]
+
+
+def search_ids(q) -> list:
+    return [artist["_id"] for artist in conn.artists.find(search.match(q), {"_id": 1})]
 
 
 def get(artist_id: str = None, user_id: str = None):
-    artist = None
     if artist_id:
         check_valid_artist_id(artist_id)
-        artist = conn.artists.find_one({"_id": ObjectId(artist_id)})
+        key, mongo_query = ('id', str(artist_id)), {"_id": ObjectId(artist_id)}
     elif user_id:
-        artist = conn.artists.find_one({"user_id": user_id})
-    return _artist_entity(artist)
-
-
-def get_name(artist_id: str):
-    artist = conn.artists.find_one({"_id": ObjectId(artist_id)})
-    return artist['name']
+        key, mongo_query = ('user', user_id), {"user_id": user_id}
+    else:
+        return None
+
+    artist = _cache.get(key)
+    if artist:
+        return artist.copy()
+    return _cache_set(_artist_entity(conn.artists.find_one(mongo_query)))
+
+
+def get_many(artists_ids) -> dict:
+    artists = {}
+    missing = []
+    for artist_id in {str(artist_id) for artist_id in artists_ids if ObjectId.is_valid(artist_id)}:
+        artist = _cache.get(('id', artist_id))
+        if artist:
+            artists[artist_id] = artist
+        else:
+            missing.append(ObjectId(artist_id))
+    if missing:
+        for artist in conn.artists.find({"_id": {"$in": missing}}):
+            artist = _cache_set(_artist_entity(artist))
+            artists[artist['id']] = artist
+    return artists
+
+
+def get_names(artists_ids) -> dict:
+    return {artist_id: artist['name'] for artist_id, artist in get_many(artists_ids).items()}
+
+
+def fill_names(items: list):
+    names = get_names(artist_id for item in items if 'artists_names' not in item for artist_id in item['artists'])
+    for item in items:
+        if 'artists_names' in item:
+            item['artists'] = item.pop('artists_names')
+        else:
+            item['artists'] = [names[artist_id] for artist_id in item['artists'] if artist_id in names]
+    return items
+
+
+def load_many(artists_ids) -> dict:
+    """Reads the artists from Mongo, bypassing the cache, for values that are going to be stored."""
+    ids = list({ObjectId(artist_id) for artist_id in artists_ids if ObjectId.is_valid(artist_id)})
+    artists = {}
+    if ids:
+        for artist in conn.artists.find({"_id": {"$in": ids}}):
+            artist = _cache_set(_artist_entity(artist))
+            artists[artist['id']] = artist
+    return artists
+
+
+def denormalize(artists_ids: list, artists: dict = None) -> dict:
+    """Artist fields stored on songs and albums. Read from Mongo unless given, another worker may have changed them."""
+    if artists is None:
+        artists = load_many(artists_ids)
+    found = [artists[str(artist_id)] for artist_id in artists_ids if str(artist_id) in artists]
+    return {
+        'artists_names': [artist['name'] for artist in found],
+        'subscription_level': max((artist.get('subscription_level') or 0 for artist in found), default=0)
+    }
+
+
+def refresh_denormalized(mongo_query: dict = None, batch_size: int = 500) -> int:
+    count = 0
+    artists = {}
+    for collection in (conn.songs, conn.albums):
+        batch = []
+        for document in collection.find(mongo_query or {}, {'artists': 1, 'artists_names': 1, 'subscription_level': 1}):
+            missing = [artist_id for artist_id in document['artists'] if str(artist_id) not in artists]
+            if missing:
+                artists.update(load_many(missing))
+            denormalized = denormalize(document['artists'], artists)
+            if all(document.get(field) == value for field, value in denormalized.items()):
+                continue
+            batch.append(UpdateOne({'_id': document['_id']},
+                                   {'$set': denormalized, '$currentDate': {'updated_at': True}}))
+            if len(batch) == batch_size:
+                count += collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            count += collection.bulk_write(batch, ordered=False).modified_count
+    return count
 
 
 def create(name, subscription_level, user_id):
@@ -46,17 +152,18 @@ def create(name, subscription_level, user_id):
     artist_dict['name'] = name
     artist_dict['user_id'] = user_id
     artist_dict['subscription_level'] = subscription_level if subscription_level else 0
-    artist_dict['date_created'] = datetime.datetime.today()
-    r = conn.artists.insert_one(artist_dict)
-    mongo_artist = conn.artists.find_one({'_id': r.inserted_id})
+    artist_dict['date_created'] = to_millis(datetime.datetime.today())
+    artist_dict[search.KEYS_FIELD] = search.document_keys(artist_dict, SEARCH_FIELDS)
+    conn.artists.insert_one(artist_dict)
 
-    return _artist_entity(mongo_artist)
+    return _cache_set(_artist_entity(artist_dict))
 
 
 def update(artist_id, name=None, subscription_level=None):
     artist = {}
     if name:
         artist['name'] = name
+        artist[search.KEYS_FIELD] = search.document_keys(artist, SEARCH_FIELDS)
     if subscription_level:
         artist['subscription_level'] = subscription_level
     updated_artist = conn.artists.find_one_and_update(
@@ -64,9 +171,15 @@ def update(artist_id, name=None, subscription_level=None):
         {"$set": artist},
         return_document=pymongo.ReturnDocument.AFTER
     )
-    return _artist_entity(updated_artist)
+    _cache_set(_artist_entity(updated_artist))
+    if updated_artist:
+        refresh_denormalized({'artists': ObjectId(artist_id)})
+    return updated_artist
 
 
 def delete(artist_id):
-    r = conn.artists.delete_one({"_id": ObjectId(artist_id)})
-    return r.deleted_count > 0
+    deleted_artist = _artist_entity(conn.artists.find_one_and_delete({"_id": ObjectId(artist_id)}))
+    _cache_delete(deleted_artist)
+    if deleted_artist:
+        refresh_denormalized({'artists': ObjectId(artist_id)})
+    return deleted_artist is not None
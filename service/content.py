@@ -1,52 +1,202 @@
+import base64
+import datetime
+import hashlib
+import os
+import tempfile
+
+from bson import ObjectId
 from google.cloud import exceptions
+from google.resumable_media import DataCorruption
 
 import service.artist
-import service.song
-from config.db import bucket
-from config.db import conn
-from exceptions.content_exceptions import ContentForbidden
-from exceptions.song_exceptions import SongNotFound
-from utils.user import is_admin
+import service.subscription
+from config.db import bucket, conn
+from exceptions.content_exceptions import ContentTooLarge, ContentChecksumMismatch, RangeNotSatisfiable, \
+    SeekNotSupported
+from utils.disk_cache import DiskCache
+from utils.mp3 import FrameIndex, seek_offset
+
+CHUNK_SIZE = int(os.getenv('CONTENT_CHUNK_SIZE', 256 * 1024))
+# Resumable uploads to the bucket require a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 200 * 1024 * 1024))
+SIGNED_URL_TTL = int(os.getenv('SIGNED_URL_TTL', 300))
+# Content at least this large is redirected to a signed bucket URL instead of going through the worker, 0 disables it
+CONTENT_REDIRECT_MIN_SIZE = int(os.getenv('CONTENT_REDIRECT_MIN_SIZE', 0))
+
+
+_cache = DiskCache(os.getenv('CONTENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'songs-content-cache')),
+                   int(os.getenv('CONTENT_CACHE_MAX_BYTES', 1024 * 1024 * 1024)))
+
+
+class CachedContent:
+    """Content in the local cache, opened once so an eviction while it is streamed does not cut the response."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+
+    def download_as_bytes(self, start: int, end: int) -> bytes:
+        self._file.seek(start)
+        return self._file.read(end - start + 1)
+
+    def close(self):
+        self._file.close()
+
+
+def cache_info() -> dict:
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def cache_served(size: int):
+    _cache.served(size)
+
+
+def _blob_name(song: dict) -> str:
+    # Content uploaded before content addressing lives under the song id
+    return song.get("content_key") or f"{song['id']}/{song['id']}.mp3"
+
+
+def _cache_key(song: dict) -> str:
+    return song.get("content_hash") or song["id"]
+
+
+def _content_key(sha256: str) -> str:
+    return f"content/{sha256}.mp3"
 
 
-def get_song_content(song_id: str):
-    blob = bucket.blob(f"{song_id}/{song_id}.mp3")
+def get_song_content_blob(song: dict):
+    path = _cache.get(_cache_key(song))
+    if path:
+        try:
+            return CachedContent(path)
+        except FileNotFoundError:
+            pass
+    blob = bucket.get_blob(_blob_name(song))
+    if not blob or not blob.size:
+        return None
+    return blob
+
+
+def seek_range(song: dict, seconds: float, size: int) -> tuple[int, int]:
+    if not song.get("seek_table"):
+        raise SeekNotSupported(song["id"])
+    if seconds >= song["duration"]:
+        raise RangeNotSatisfiable(size)
+    return seek_offset(song["seek_table"], seconds), size - 1
+
+
+def should_redirect(size: int, requested: bool = None) -> bool:
+    if requested is not None:
+        return requested
+    return 0 < CONTENT_REDIRECT_MIN_SIZE <= size
+
+
+def get_signed_url(song: dict) -> str:
+    return bucket.blob(_blob_name(song)).generate_signed_url(
+        expiration=datetime.timedelta(seconds=SIGNED_URL_TTL), method="GET", version="v4", response_type="audio/mpeg"
+    )
+
+
+def cache_writer(song: dict, blob):
+    """Returns a writer to cache the content from the chunks streamed to the client, None if it should not be cached."""
+    if blob.size > _cache.max_bytes:
+        return None
+    return _cache.writer(_cache_key(song))
+
+
+def read_song_content(blob, start: int, end: int) -> bytes:
     try:
-        contents = blob.download_as_string()
+        return blob.download_as_bytes(start=start, end=end)
     except exceptions.NotFound:
-        return None
-    return contents
+        return b""
+
+
+def _inspect(file) -> tuple[int, str, str, dict]:
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    frames = FrameIndex()
+    size = 0
+    for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > MAX_UPLOAD_SIZE:
+            raise ContentTooLarge(MAX_UPLOAD_SIZE)
+        md5.update(chunk)
+        sha256.update(chunk)
+        frames.feed(chunk)
+    file.seek(0)
+    return size, base64.b64encode(md5.digest()).decode(), sha256.hexdigest(), frames.result() or {}
+
 
+def _upload(song_id: str, key: str, file, size: int, md5_hash: str):
+    blob = bucket.blob(key, chunk_size=UPLOAD_CHUNK_SIZE)
+    try:
+        blob.upload_from_file(file, size=size, content_type="audio/mpeg", checksum="md5")
+        blob.reload()
+        verified = blob.md5_hash == md5_hash
+    except DataCorruption:
+        verified = False
+    if not verified:
+        try:
+            blob.delete()
+        except exceptions.NotFound:
+            pass
+        raise ContentChecksumMismatch(song_id)
+
+
+def upload_song_content(song_id: str, file) -> dict:
+    """Stores the content under its SHA-256 and returns the fields to keep on the song.
 
-def upload_song_content(song_id: str, contents):
-    blob = bucket.blob(f"{song_id}/{song_id}.mp3")
-    blob.upload_from_string(contents)
+    Content already in the bucket with the same checksum is not uploaded again.
+    """
+    size, md5_hash, sha256, metadata = _inspect(file)
+    key = _content_key(sha256)
+    blob = bucket.get_blob(key)
+    if not blob or blob.md5_hash != md5_hash:
+        _upload(song_id, key, file, size, md5_hash)
+    # Cached content is keyed by its hash, so the new content gets a new entry and nothing has to be evicted
+    return {
+        "content_key": key,
+        "content_hash": sha256,
+        "duration": metadata.get("duration"),
+        "bitrate": metadata.get("bitrate"),
+        "seek_table": metadata.get("seek_table"),
+    }
 
 
-def verify_download(user_id: str, song_id: str, authorization):
-    if is_admin(user_id, authorization):
-        return
+def _required_level(song: dict) -> int:
+    if 'subscription_level' in song:
+        return song['subscription_level'] or 0
+    return service.artist.denormalize(song['artists'])['subscription_level']
 
-    song = service.song.get(song_id)
-    if not song:
-        raise SongNotFound(song_id)
 
-    artists_max_level = 0
-    for artist_id in song['artists']:
-        artist = service.artist.get(artist_id)
-        if artist['user_id'] == user_id:
-            return
-        if "subscription_level" in artist:
-            artists_max_level = max(artists_max_level, artist["subscription_level"])
-    if artists_max_level == 0:
-        return
+def get_entitlements(user_id: str, songs: list[dict]) -> dict:
+    """Maps each song id to whether the user can play it, from the denormalized song level and cached user data."""
+    level = service.subscription.get_level(user_id)
+    required = {song['id']: _required_level(song) for song in songs}
+    # Most users are not artists and misses are not cached, so the artist is only looked up when it matters
+    artist = service.artist.get(user_id=user_id) if user_id and max(required.values(), default=0) > level else None
+    artist_id = artist['id'] if artist else None
+    return {
+        song['id']: required[song['id']] <= level or artist_id in [str(a) for a in song['artists']]
+        for song in songs
+    }
 
-    user_subscription_level = 0
-    subscription = conn.subscriptions.find_one({"user_id": user_id})
-    if subscription:
-        user_subscription_level = subscription["subscription_type_level"]
 
-    if user_subscription_level >= artists_max_level:
-        return
+def get_playlist_entitlements(user_id: str, playlist_id: str):
+    playlist = conn.playlists.find_one({"_id": ObjectId(playlist_id)}, {"songs": 1})
+    if not playlist:
+        return None
+    songs_ids = [ObjectId(song_id) for song_id in playlist["songs"]]
+    songs = conn.songs.find({"_id": {"$in": songs_ids}}, {"artists": 1, "subscription_level": 1})
+    entitlements = get_entitlements(user_id, [{**song, "id": str(song["_id"])} for song in songs])
+    return {str(song_id): entitlements.get(str(song_id), False) for song_id in songs_ids}
+
 
-    raise ContentForbidden(song_id, user_id)
+def can_download(user_id: str, song: dict) -> bool:
+    return get_entitlements(user_id, [song])[song['id']]
@@ -0,0 +1,133 @@
+import asyncio
+import datetime
+import logging
+import os
+import uuid
+from decimal import Decimal
+
+import requests
+from pymongo.errors import DuplicateKeyError
+
+import service.artist
+from config.db import conn
+from utils.executor import run_blocking
+
+logger = logging.getLogger('main-logger')
+
+# Downloads are only queued for payment where a dispatcher sends them, otherwise the outbox would grow forever
+PAYMENTS_ENABLED = os.getenv('PAYMENTS_ENABLED', str(os.getenv('CURRENT_ENVIRONMENT') == 'production')).lower() == 'true'
+PAYMENT_SERVICE_URL = os.getenv('PAYMENT_SERVICE_URL', "https://spotifiuby-payment-service.herokuapp.com/payment")
+PAYMENT_DISPATCH_INTERVAL = float(os.getenv('PAYMENT_DISPATCH_INTERVAL', 30))
+PAYMENT_BATCH_SIZE = int(os.getenv('PAYMENT_BATCH_SIZE', 1000))
+PAYMENT_MAX_BACKOFF = float(os.getenv('PAYMENT_MAX_BACKOFF', 3600))
+# A user is charged for a song once per window, whatever part of it they download
+PLAY_CHARGE_WINDOW = float(os.getenv('PLAY_CHARGE_WINDOW', 3600))
+# A worker that dies while sending leaves its claim behind; other workers retake it after this many seconds
+CLAIM_TIMEOUT = 300
+
+PRICES = {
+    1: Decimal("0.00000005"),
+    2: Decimal("0.0000001"),
+    3: Decimal("0.00000015"),
+}
+
+PENDING = "pending"
+SENDING = "sending"
+
+
+def enqueue(song: dict) -> int:
+    if not PAYMENTS_ENABLED:
+        return 0
+    now = datetime.datetime.utcnow()
+    payments = []
+    for artist in service.artist.get_many(song['artists']).values():
+        price = PRICES.get(artist.get('subscription_level'))
+        if price:
+            payments.append({
+                "artist_id": artist['user_id'],
+                "song_id": song['id'],
+                "amount": format(price, 'f'),
+                "status": PENDING,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            })
+    if payments:
+        conn.payments_outbox.insert_many(payments)
+    return len(payments)
+
+
+def charge_play(user_id: str, song: dict) -> int:
+    """Enqueues the payments for a download unless the user was already charged for the song in this window."""
+    if not PAYMENTS_ENABLED:
+        return 0
+    if user_id:
+        now = datetime.datetime.utcnow()
+        try:
+            # Matches only an expired play, so a recent one makes the upsert collide on _id
+            conn.plays.update_one(
+                {'_id': f"{user_id}:{song['id']}", 'expires_at': {'$lte': now}},
+                {'$set': {'expires_at': now + datetime.timedelta(seconds=PLAY_CHARGE_WINDOW)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return 0
+    return enqueue(song)
+
+
+def post_payment(artist_id: str, amount: Decimal):
+    r = requests.post(PAYMENT_SERVICE_URL, json={"artistId": artist_id, "amountInEthers": format(amount, 'f')},
+                      timeout=10)
+    r.raise_for_status()
+
+
+def _backoff(attempts: int) -> datetime.timedelta:
+    return datetime.timedelta(seconds=min(PAYMENT_DISPATCH_INTERVAL * 2 ** attempts, PAYMENT_MAX_BACKOFF))
+
+
+def _claim(now: datetime.datetime, batch_size: int) -> str:
+    claimable = {'$or': [
+        {'status': PENDING, 'next_attempt_at': {'$lte': now}},
+        {'status': SENDING, 'claimed_at': {'$lte': now - datetime.timedelta(seconds=CLAIM_TIMEOUT)}},
+    ]}
+    ids = [payment['_id'] for payment in conn.payments_outbox.find(claimable, {'_id': 1}).limit(batch_size)]
+    claim = uuid.uuid4().hex
+    conn.payments_outbox.update_many({'_id': {'$in': ids}, **claimable},
+                                     {'$set': {'status': SENDING, 'claim': claim, 'claimed_at': now}})
+    return claim
+
+
+def dispatch(send=post_payment, batch_size: int = PAYMENT_BATCH_SIZE) -> int:
+    """Sends one aggregated payment per artist for the claimed outbox entries and returns how many were sent."""
+    now = datetime.datetime.utcnow()
+    claim = _claim(now, batch_size)
+    by_artist = {}
+    for payment in conn.payments_outbox.find({'claim': claim}, {'artist_id': 1, 'amount': 1, 'attempts': 1}):
+        by_artist.setdefault(payment['artist_id'], []).append(payment)
+
+    sent = 0
+    for artist_id, payments in by_artist.items():
+        ids = [payment['_id'] for payment in payments]
+        try:
+            send(artist_id, sum((Decimal(payment['amount']) for payment in payments), Decimal(0)))
+        except Exception:
+            logger.exception(f"Payment to artist {artist_id} failed")
+            attempts = max(payment['attempts'] for payment in payments) + 1
+            conn.payments_outbox.update_many(
+                {'_id': {'$in': ids}, 'claim': claim},
+                {'$set': {'status': PENDING, 'attempts': attempts, 'next_attempt_at': now + _backoff(attempts)},
+                 '$unset': {'claim': "", 'claimed_at': ""}}
+            )
+            continue
+        conn.payments_outbox.delete_many({'_id': {'$in': ids}, 'claim': claim})
+        sent += len(ids)
+    return sent
+
+
+async def dispatch_forever(interval: float = PAYMENT_DISPATCH_INTERVAL, send=post_payment):
+    while True:
+        try:
+            await run_blocking(dispatch, send)
+        except Exception:
+            logger.exception("Payment dispatch failed")
+        await asyncio.sleep(interval)
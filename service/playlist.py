@@ -3,36 +3,42 @@ import pymongo
 import datetime
 
 from config.db import conn
-from exceptions.playlist_exceptions import PlaylistNotFound
+from exceptions.playlist_exceptions import PlaylistNotOwnedByUser
 import service.song
+from utils import search
+from utils.dates import to_millis
 
 
 def _playlist_entity(playlist) -> dict:
     if not playlist:
         return playlist
     playlist["id"] = str(playlist.pop("_id"))
+    playlist.pop(search.KEYS_FIELD, None)
     playlist["songs"] = [str(song_id) for song_id in playlist["songs"]]
     return playlist
 
 
-def _regex_query(field, q):
-    return {field: {'$regex': q, '$options': 'i'}}
+SEARCH_FIELDS = ['name', 'owner']
 
 
-def is_owner(playlist_id, user_id):
-    playlist = conn.playlists.find_one({'_id': ObjectId(playlist_id)})
-    if not playlist:
-        raise PlaylistNotFound(playlist_id)
-    return playlist['owner'] == user_id
+def _owned(playlist_id, owner) -> dict:
+    return {"_id": ObjectId(playlist_id), "owner": owner}
+
+
+def _check_miss(playlist_id, owner):
+    # Only a scoped write that matched nothing needs to tell a missing playlist from someone else's
+    if conn.playlists.count_documents({"_id": ObjectId(playlist_id)}, limit=1):
+        raise PlaylistNotOwnedByUser(playlist_id, owner)
 
 
-def find(q):
-    if not q:
-        mongo_query = {}
-    else:
-        fields = ['name', 'owner']
-        mongo_query = {'$or': [_regex_query(field, q) for field in fields]}
-    return [_playlist_entity(playlist) for playlist in conn.playlists.find(mongo_query)]
+def find(q, after=None, limit: int = None):
+    q = search.query(q)
+    mongo_query = search.match(q) if q else {}
+    pipeline = [{'$match': mongo_query}, *search.sort_stages(q, after)]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$unset': search.KEYS_FIELD})
+    return [_playlist_entity(playlist) for playlist in conn.playlists.aggregate(pipeline)]
 
 
 def get(playlist_id: str):
@@ -48,32 +54,37 @@ def get_songs(playlist_id: str, subscription_level: int):
 
 def create(playlist, owner):
     playlist_dict = playlist.dict()
-    playlist_dict["date_created"] = datetime.datetime.today()
+    playlist_dict["date_created"] = to_millis(datetime.datetime.today())
+    playlist_dict["updated_at"] = to_millis(datetime.datetime.utcnow())
     playlist_dict["owner"] = owner
     playlist_dict["songs"] = [ObjectId(song_id) for song_id in playlist_dict["songs"]]
     if "cover" not in playlist_dict:
         playlist_dict["cover"] = None
-    r = conn.playlists.insert_one(playlist_dict)
-    mongo_playlist = conn.playlists.find_one({"_id": r.inserted_id})
+    playlist_dict[search.KEYS_FIELD] = search.document_keys(playlist_dict, SEARCH_FIELDS)
+    conn.playlists.insert_one(playlist_dict)
 
-    return _playlist_entity(mongo_playlist)
+    return _playlist_entity(playlist_dict)
 
 
-def add_songs(playlist_id, songs):
+def add_songs(playlist_id, songs, owner):
     updated_playlist = conn.playlists.find_one_and_update(
-        {"_id": ObjectId(playlist_id)},
-        {"$push": {"songs": {"$each": songs}}},
+        _owned(playlist_id, owner),
+        {"$push": {"songs": {"$each": songs}}, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
+    if not updated_playlist:
+        _check_miss(playlist_id, owner)
     return _playlist_entity(updated_playlist)
 
 
-def delete_song(playlist_id, song_id):
+def delete_song(playlist_id, song_id, owner):
     updated_playlist = conn.playlists.find_one_and_update(
-        {"_id": ObjectId(playlist_id)},
-        {"$pull": {"songs": song_id}},
+        _owned(playlist_id, owner),
+        {"$pull": {"songs": song_id}, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
+    if not updated_playlist:
+        _check_miss(playlist_id, owner)
     return _playlist_entity(updated_playlist)
 
 
@@ -83,9 +94,14 @@ def update(playlist_id, playlist):
         to_update["songs"] = [ObjectId(song_id) for song_id in to_update["songs"]]
     updated_playlist = conn.playlists.find_one_and_update(
         {"_id": ObjectId(playlist_id)},
-        {"$set": to_update},
+        {"$set": to_update, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
+    if updated_playlist and any(field in to_update for field in SEARCH_FIELDS):
+        conn.playlists.update_one(
+            {"_id": updated_playlist["_id"]},
+            {"$set": {search.KEYS_FIELD: search.document_keys(updated_playlist, SEARCH_FIELDS)}}
+        )
     return _playlist_entity(updated_playlist)
 
 
@@ -6,60 +6,52 @@ from config.db import conn
 from models.song import StatusEnum
 import service.artist
 from exceptions.artist_exception import ArtistNotFoundForUser
-from exceptions.song_exceptions import SongNotFound
+from utils import search
+from utils.dates import to_millis
 
 
 def _song_entity(song) -> dict:
     if not song:
         return song
     song["id"] = str(song.pop("_id"))
+    song.pop(search.KEYS_FIELD, None)
     song['artists'] = [str(artist_id) for artist_id in song['artists']]
     return song
 
 
-def _regex_query(field, q):
-    return {field: {'$regex': q, '$options': 'i'}}
+SEARCH_FIELDS = ['name', 'genre']
 
 
-def find(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None):
+def find(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+         after=None, limit: int = None):
+    return list(stream(q, artist_id, songs_ids, subscription_level, after, limit))
+
+
+def _pipeline(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+              after=None, limit: int = None) -> list:
+    q = search.query(q)
     mongo_query = {}
     if q:
-        fields = ['name', 'artists_names', 'genre']
-        mongo_query = {'$or': [_regex_query(field, q) for field in fields]}
+        mongo_query = {'$or': [search.match(q), {'artists': {'$in': service.artist.search_ids(q)}}]}
     if artist_id:
         mongo_query['artists'] = ObjectId(artist_id)
-    if subscription_level is not None:
-        mongo_query['subscription_level'] = {'$lte': subscription_level}
     if songs_ids:
         mongo_query['_id'] = {'$in': [ObjectId(song_id) for song_id in songs_ids]}
+    if subscription_level is not None:
+        mongo_query['subscription_level'] = {'$not': {'$gt': subscription_level}}
 
-    pipeline = [
-        {
-            '$lookup': {
-                'from': 'artists',
-                'localField': 'artists',
-                'foreignField': '_id',
-                'as': 'artists_data'
-            }
-        }, {
-            '$addFields': {
-                'subscription_level': {
-                    '$max': '$artists_data.subscription_level'
-                },
-                'artists_names': '$artists_data.name'
-            }
-        }, {
-            '$match': mongo_query
-        }, {
-            '$unset': [
-                'artists_data',
-                'artists_names',
-                'subscription_level'
-            ]
-        }
-    ]
-
-    return [_song_entity(song) for song in conn.songs.aggregate(pipeline)]
+    pipeline = [{'$match': mongo_query}, *search.sort_stages(q, after)]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$unset': [search.KEYS_FIELD, 'seek_table']})
+    return pipeline
+
+
+def stream(q: str = None, artist_id: str | ObjectId = None, songs_ids: list = None, subscription_level: int = None,
+           after=None, limit: int = None):
+    pipeline = _pipeline(q, artist_id, songs_ids, subscription_level, after, limit)
+    for song in conn.songs.aggregate(pipeline):
+        yield _song_entity(song)
 
 
 def get(song_id: str):
@@ -67,70 +59,97 @@ def get(song_id: str):
     return _song_entity(song)
 
 
-def create(song, user_id):
+def get_statuses(songs_ids: list) -> dict:
+    songs = conn.songs.find({"_id": {"$in": [ObjectId(song_id) for song_id in songs_ids]}}, {"status": 1})
+    return {str(song["_id"]): song["status"] for song in songs}
+
+
+def get_many(songs_ids: list, subscription_level: int = None) -> tuple[list, list]:
+    """Returns the songs in the order of the given ids, and the ids that were not found or are not available."""
+    songs = {song['id']: song for song in find(songs_ids=songs_ids, subscription_level=subscription_level)}
+    return [songs[song_id] for song_id in songs_ids if song_id in songs], \
+        [song_id for song_id in songs_ids if song_id not in songs]
+
+
+def _new_song(song, artists: list, found: dict) -> dict:
     song_dict = song.dict()
-    if "artists" not in song_dict or not song_dict["artists"]:
-        song_dict["artists"] = []
-    else:
-        song_dict["artists"] = [ObjectId(a) for a in song_dict["artists"]]
+    song_dict["artists"] = artists
+    song_dict.update(service.artist.denormalize(artists, found))
+    song_dict["status"] = StatusEnum.not_uploaded
+    song_dict["date_created"] = to_millis(datetime.datetime.today())
+    song_dict["date_uploaded"] = None
+    song_dict["updated_at"] = to_millis(datetime.datetime.utcnow())
+    song_dict[search.KEYS_FIELD] = search.document_keys(song_dict, SEARCH_FIELDS)
+    return song_dict
 
-    for artist_id in song_dict["artists"]:
-        artist = service.artist.get(artist_id)
-        if not artist:
-            raise ArtistNotFoundForUser(user_id)
 
-    if len(song_dict["artists"]) == 0:
+def create_many(songs: list, user_id) -> list:
+    """Creates the songs with one artist lookup and one insert, songs without artists belong to the user's artist."""
+    songs_artists = [[ObjectId(a) for a in song.artists or []] for song in songs]
+    if not all(songs_artists):
         artist = service.artist.get(user_id=user_id)
         if not artist:
             raise ArtistNotFoundForUser(user_id)
-        user_artist_id = ObjectId(artist['id'])
-        song_dict["artists"].insert(0, user_artist_id)
+        songs_artists = [artists or [ObjectId(artist['id'])] for artists in songs_artists]
 
-    song_dict["status"] = StatusEnum.not_uploaded
-    song_dict["date_created"] = datetime.datetime.today()
-    song_dict["date_uploaded"] = None
-    r = conn.songs.insert_one(song_dict)
-    mongo_song = conn.songs.find_one({"_id": r.inserted_id})
+    found = service.artist.load_many(artist_id for artists in songs_artists for artist_id in artists)
+    if any(str(artist_id) not in found for artists in songs_artists for artist_id in artists):
+        raise ArtistNotFoundForUser(user_id)
 
-    return _song_entity(mongo_song)
+    songs_dicts = [_new_song(song, artists, found) for song, artists in zip(songs, songs_artists)]
+    conn.songs.insert_many(songs_dicts)
 
+    return [_song_entity(song_dict) for song_dict in songs_dicts]
 
-def is_owner(song_id, user_id):
-    song = conn.songs.find_one({'_id': ObjectId(song_id)})
-    if not song:
-        raise SongNotFound(song_id)
-    for artist_id in song['artists']:
-        artist = service.artist.get(artist_id)
-        if artist['user_id'] == user_id:
-            return True
-    return False
+
+def create(song, user_id):
+    return create_many([song], user_id)[0]
 
 
-def update(song_id, song):
+def _scoped(song_id, artist_id=None) -> dict:
+    query = {"_id": ObjectId(song_id)}
+    if artist_id:
+        query["artists"] = ObjectId(artist_id)
+    return query
+
+
+def exists(song_id) -> bool:
+    return conn.songs.count_documents({"_id": ObjectId(song_id)}, limit=1) > 0
+
+
+def update(song_id, song, artist_id=None):
     to_update = {k: v for k, v in song.dict().items() if v is not None}
     if "artists" in to_update:
         to_update["artists"] = [ObjectId(artist_id) for artist_id in to_update["artists"]]
+        to_update.update(service.artist.denormalize(to_update["artists"]))
     updated_song = conn.songs.find_one_and_update(
-        {"_id": ObjectId(song_id)},
-        {"$set": to_update},
+        _scoped(song_id, artist_id),
+        {"$set": to_update, "$currentDate": {"updated_at": True}},
         return_document=pymongo.ReturnDocument.AFTER
     )
+    if updated_song and any(field in to_update for field in SEARCH_FIELDS):
+        conn.songs.update_one(
+            {"_id": updated_song["_id"]},
+            {"$set": {search.KEYS_FIELD: search.document_keys(updated_song, SEARCH_FIELDS)}}
+        )
     return _song_entity(updated_song)
 
 
-def delete(song_id):
-    r = conn.songs.delete_one({"_id": ObjectId(song_id)})
+def delete(song_id, artist_id=None):
+    r = conn.songs.delete_one(_scoped(song_id, artist_id))
     return r.deleted_count > 0
 
 
-def activate_song(song_id):
+def activate_song(song_id, content: dict = None):
     updated_song = conn.songs.find_one_and_update(
         {"_id": ObjectId(song_id)},
         {
             "$set": {
                 "status": StatusEnum.active,
-                "date_uploaded": datetime.datetime.today()
-            }
+                "date_uploaded": datetime.datetime.today(),
+                **(content or {})
+            },
+            "$currentDate": {"updated_at": True}
         },
         return_document=pymongo.ReturnDocument.AFTER
     )
@@ -0,0 +1,71 @@
+import datetime
+import os
+import threading
+import time
+
+from config.db import conn
+from utils.cache import Cache
+
+# Subscriptions are written by the users service, which calls the invalidation route on every change. The TTL bounds
+# staleness if that call is lost.
+_cache = Cache(maxsize=int(os.getenv('SUBSCRIPTION_CACHE_SIZE', 4096)),
+               ttl=float(os.getenv('SUBSCRIPTION_CACHE_TTL', 30)))
+# Invalidations are logged in Mongo so every worker evicts the user, each worker reads the log at most this often
+INVALIDATION_POLL_INTERVAL = float(os.getenv('SUBSCRIPTION_INVALIDATION_POLL', 1))
+# Invalidations logged by other workers are read again for this long, in case their clocks are behind
+_CLOCK_SKEW = datetime.timedelta(seconds=5)
+
+_sync_lock = threading.Lock()
+_last_sync = 0.0
+_seen_until = datetime.datetime.utcnow()
+# Invalidations already applied by this worker that are still read again because of the clock skew, by id
+_applied = {}
+
+
+def _sync_invalidations():
+    global _last_sync, _seen_until
+    if time.monotonic() - _last_sync < INVALIDATION_POLL_INTERVAL or not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        since = _seen_until - _CLOCK_SKEW
+        users = []
+        for invalidation in conn.subscription_invalidations.find({'at': {'$gt': since}}, {'user_id': 1, 'at': 1}):
+            if invalidation['_id'] in _applied:
+                continue
+            _applied[invalidation['_id']] = invalidation['at']
+            users.append(invalidation['user_id'])
+            _seen_until = max(_seen_until, invalidation['at'])
+        _cache.delete(*users)
+        since = _seen_until - _CLOCK_SKEW
+        for invalidation_id, at in list(_applied.items()):
+            if at <= since:
+                del _applied[invalidation_id]
+        _last_sync = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+
+def get_level(user_id: str) -> int:
+    if not user_id:
+        return 0
+    _sync_invalidations()
+    level = _cache.get(user_id)
+    if level is None:
+        subscription = conn.subscriptions.find_one({'user_id': user_id}, {'subscription_type_level': 1})
+        level = subscription['subscription_type_level'] if subscription else 0
+        _cache.set(user_id, level)
+    return level
+
+
+def invalidate(user_id: str):
+    at = datetime.datetime.utcnow()
+    _applied[conn.subscription_invalidations.insert_one({'user_id': user_id, 'at': at}).inserted_id] = at
+    _cache.delete(user_id)
+
+
+def cache_info() -> dict:
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,28 @@
+import pytest
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+_counter = CommandCounter()
+# Listeners only apply to clients created after registering, so this must run before config.db is imported
+monitoring.register(_counter)
+
+
+@pytest.fixture()
+def mongo_commands():
+    """Names of the Mongo commands sent during the test, after the fixtures requested before this one."""
+    _counter.commands.clear()
+    return _counter.commands
@@ -1,11 +1,17 @@
 import pytest
 from bson import ObjectId
 import datetime
+import json
 from fastapi.testclient import TestClient
 
 from main import app
+from models.album import CreateAlbumRequest
 from config.db import conn
+from config.indexes import ensure_indexes
+import service.album
+import service.artist
 from tests.test_artists import TEST_ARTIST, TEST_ARTIST_2
+from tests.test_songs import _uses_index, OTHER_SONGS
 
 client = TestClient(app)
 
@@ -62,6 +68,7 @@ def mongo_test_empty():
     conn.albums.delete_many({})
     conn.songs.delete_many({})
     conn.artists.delete_many({})
+    service.artist.clear_cache()
 
 
 @pytest.fixture()
@@ -125,6 +132,14 @@ def test_create_album(mongo_test):
     assert response.json()["year"] == test_album["year"]
 
 
+def test_create_album_no_read_after_insert(mongo_test, mongo_commands):
+    album = CreateAlbumRequest(name="test", artists=[str(TEST_ARTIST['_id'])], songs=[str(TEST_SONG_1["_id"])], year=2022)
+    created = service.album.create(album)
+    assert mongo_commands == ["find", "insert"]
+    assert created["songs"] == [str(TEST_SONG_1["_id"])]
+    assert created["artists_names"] == [TEST_ARTIST['name']]
+
+
 def test_get_all_albums(mongo_test_songs):
     test_album = {
         "name": "test",
@@ -141,6 +156,41 @@ def test_get_all_albums(mongo_test_songs):
     assert len(response.json()) == 10
 
 
+def test_get_albums_paginated(mongo_test_songs):
+    test_album = {
+        "name": "test",
+        "artists": [str(TEST_ARTIST['_id'])],
+        "songs": [str(TEST_SONG_1["_id"])],
+        "year": 1990}
+    created = [client.post("/albums", json=test_album).json()["id"] for _ in range(3)]
+    response = client.get("/albums", params={"limit": 2})
+    assert [album["id"] for album in response.json()] == created[:2]
+    response = client.get("/albums", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [album["id"] for album in response.json()] == created[2:]
+
+
+def test_get_albums_ndjson(mongo_test):
+    response = client.get("/albums", headers={"accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [album["id"] for album in lines] == [str(TEST_ALBUM["_id"])]
+    assert lines[0]["artists"] == [TEST_ARTIST['name']]
+
+
+def test_find_albums_pipeline_filters_first():
+    pipeline = service.album._pipeline(artist_id=str(TEST_ARTIST["_id"]), subscription_level=0)
+    assert pipeline[0] == {"$match": {"artists": TEST_ARTIST["_id"], "subscription_level": {"$not": {"$gt": 0}}}}
+
+
+def test_find_albums_by_artist_uses_index(mongo_test):
+    conn.albums.insert_many([{**TEST_ALBUM, "_id": ObjectId(), "artists": [TEST_ARTIST_2["_id"]]}
+                             for _ in range(OTHER_SONGS)])
+    ensure_indexes(conn)
+    assert _uses_index(service.album._pipeline(artist_id=str(TEST_ARTIST["_id"]), subscription_level=0), "artists_1",
+                       "albums")
+
+
 def test_get_album_not_found(mongo_test):
     response = client.get("/albums/625c9dcd232be00e5f827f7b")
     assert response.status_code == 404
@@ -216,6 +266,17 @@ def test_update_album(mongo_test):
     assert response.json()["year"] == updated_album["year"]
 
 
+def test_get_album_not_modified(mongo_test):
+    tag = client.get("/albums/{}".format(str(TEST_ALBUM["_id"]))).headers["etag"]
+    response = client.get("/albums/{}".format(str(TEST_ALBUM["_id"])), headers={"if-none-match": tag})
+    assert response.status_code == 304
+
+    client.put("/albums/{}".format(str(TEST_ALBUM["_id"])), json={"name": "updated_name"})
+    response = client.get("/albums/{}".format(str(TEST_ALBUM["_id"])), headers={"if-none-match": tag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "updated_name"
+
+
 def test_update_album_not_found_fails(mongo_test_empty):
     updated_album = {"name": "updated_name"}
     response = client.put("/albums/{}".format(str(TEST_ALBUM["_id"])), json=updated_album)
@@ -4,6 +4,7 @@ import datetime
 from main import app
 from fastapi.testclient import TestClient
 from config.db import conn
+import service.artist
 
 TEST_ARTIST = {
     "_id": ObjectId("625c9dcd232be00e5f827f6a"),
@@ -27,6 +28,7 @@ client = TestClient(app)
 @pytest.fixture()
 def mongo_test_empty():
     conn.artists.delete_many({})
+    service.artist.clear_cache()
 
 
 @pytest.fixture()
@@ -55,6 +57,20 @@ def test_create_artist(mongo_test_empty):
     response.json()["user_id"] = TEST_ARTIST["user_id"]
 
 
+def test_create_artist_no_read_after_insert(mongo_test_empty, mongo_commands):
+    created = service.artist.create(TEST_ARTIST['name'], None, TEST_ARTIST['user_id'])
+    assert mongo_commands == ["insert"]
+    assert service.artist.get(user_id=TEST_ARTIST['user_id']) == created
+    assert mongo_commands == ["insert"]
+
+
+def test_create_artist_returns_stored_dates(mongo_test_empty):
+    created = service.artist.create(TEST_ARTIST['name'], None, TEST_ARTIST['user_id'])
+    stored = conn.artists.find_one({"user_id": TEST_ARTIST['user_id']})
+    assert created["date_created"] == stored["date_created"]
+    assert created["date_created"].microsecond % 1000 == 0
+
+
 def test_get_all_artists(mongo_test_empty):
     artist = {'name': TEST_ARTIST['name']}
     for i in range(10):
@@ -65,6 +81,17 @@ def test_get_all_artists(mongo_test_empty):
     assert len(response.json()) == 10
 
 
+def test_get_artists_paginated(mongo_test_empty):
+    artist = {'name': TEST_ARTIST['name']}
+    for i in range(3):
+        client.post("/artists", json=artist, headers={'x-user-id': f'user{i}@test.com'})
+    response = client.get("/artists", params={"limit": 2})
+    assert [a["user_id"] for a in response.json()] == ['user0@test.com', 'user1@test.com']
+    response = client.get("/artists", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [a["user_id"] for a in response.json()] == ['user2@test.com']
+    assert "x-next-cursor" not in response.headers
+
+
 def test_find_artist(mongo_test_empty):
     test_artist1 = {"name": "The Beatles"}
     user_id_1 = "test1@test.com"
@@ -111,6 +138,29 @@ def test_update_artist(mongo_test):
     assert response.json()["name"] == updated_artist["name"]
 
 
+def test_get_artist_cached(mongo_test):
+    client.get("/artists/{}".format(str(TEST_ARTIST["_id"])))
+    response = client.get("/artists/{}".format(str(TEST_ARTIST["_id"])))
+    assert response.status_code == 200
+    assert response.json()["name"] == TEST_ARTIST["name"]
+    assert service.artist.cache_info()["hits"] == 1
+    assert service.artist.cache_info()["misses"] == 1
+
+
+def test_update_artist_invalidates_cache(mongo_test):
+    client.get("/artists/{}".format(str(TEST_ARTIST["_id"])))
+    client.put("/artists/{}".format(str(TEST_ARTIST["_id"])), json={"name": "updated_name"})
+    assert service.artist.get(user_id=TEST_ARTIST["user_id"])["name"] == "updated_name"
+    response = client.get("/artists/{}".format(str(TEST_ARTIST["_id"])))
+    assert response.json()["name"] == "updated_name"
+
+
+def test_delete_artist_invalidates_cache(mongo_test):
+    client.get("/artists/{}".format(str(TEST_ARTIST["_id"])))
+    client.delete("/artists/{}".format(TEST_ARTIST["_id"]))
+    assert service.artist.get(user_id=TEST_ARTIST["user_id"]) is None
+
+
 def test_update_artist_not_found_fails(mongo_test_empty):
     updated_artist = {"name": "updated_name"}
     response = client.put("/artists/{}".format(str(TEST_ARTIST["_id"])), json=updated_artist,
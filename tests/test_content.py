@@ -1,13 +1,21 @@
 from fastapi.testclient import TestClient
 from bson import ObjectId
+import base64
+import hashlib
 import io
+import pathlib
 import pytest
 
 from main import app
 from models.song import StatusEnum
 from config.db import conn
 from config.db import bucket
-from tests.test_artists import TEST_ARTIST
+from config.mock_mongo import BlobMock
+import service.artist
+import service.content
+import service.subscription
+from utils.disk_cache import DiskCache
+from tests.test_artists import TEST_ARTIST, TEST_ARTIST_2
 
 client = TestClient(app)
 
@@ -16,11 +24,18 @@ SONG_NOT_AVAILABLE_ID = "625c9dcd232be00e5f827f7a"
 CONTENT_NOT_FOUND_ID = "625c9dcd232be00e5f827f7b"
 SONG_AND_CONTENT_OK = "625c9dcd232be00e5f827f7c"
 
+# 200 MPEG-1 Layer III frames at 128 kbps and 44.1 kHz behind an ID3v2 tag
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + b"\x00" * 10
+MP3 = ID3_TAG + (b"\xff\xfb\x90\x00" + b"\x00" * 413) * 200
+
 
 @pytest.fixture()
 def mongo_test_empty():
     conn.songs.delete_many({})
     conn.artists.delete_many({})
+    service.artist.clear_cache()
+    service.content.clear_cache()
+    bucket.d.clear()
 
 
 @pytest.fixture()
@@ -50,6 +65,34 @@ def test_get_content_song_not_available(mongo_test):
     assert response.json() == {'detail': f'Song {SONG_NOT_AVAILABLE_ID} not available'}
 
 
+async def _not_admin(user_id, authorization):
+    return False
+
+
+def test_get_content_forbidden(mongo_test, monkeypatch):
+    monkeypatch.setattr("routes.content.is_admin", _not_admin)
+    conn.artists.insert_one(TEST_ARTIST_2)
+    conn.songs.update_one({"_id": ObjectId(SONG_AND_CONTENT_OK)},
+                          {"$set": {"subscription_level": 2, "artists": [TEST_ARTIST_2["_id"]]}})
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"x-user-id": "free@test.com"})
+    assert response.status_code == 403
+
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"x-user-id": TEST_ARTIST_2["user_id"]})
+    assert response.status_code == 200
+
+
+def test_can_download_available_song_no_artist_lookup(mongo_test, mongo_commands):
+    song = {"id": SONG_AND_CONTENT_OK, "artists": [TEST_ARTIST["_id"]], "subscription_level": 0}
+    service.subscription.get_level("free@test.com")
+    mongo_commands.clear()
+    assert service.content.can_download("free@test.com", song)
+    assert "find" not in mongo_commands
+
+    song["subscription_level"] = 2
+    assert service.content.can_download(TEST_ARTIST["user_id"], song)
+    assert not service.content.can_download("free@test.com", song)
+
+
 def test_create_content(mongo_test):
     f = io.StringIO("content")
     response = client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
@@ -57,6 +100,57 @@ def test_create_content(mongo_test):
     assert conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})["status"] == "active"
 
 
+def test_create_content_stored_checksum(mongo_test):
+    f = io.BytesIO(b"large lossless content")
+    client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
+    song = conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})
+    assert song["content_key"] == "content/{}.mp3".format(hashlib.sha256(b"large lossless content").hexdigest())
+    blob = bucket.get_blob(song["content_key"])
+    assert blob.md5_hash == base64.b64encode(hashlib.md5(b"large lossless content").digest()).decode()
+
+
+def test_create_content_deduplicated(mongo_test, monkeypatch):
+    uploads = []
+    upload_from_file = BlobMock.upload_from_file
+    monkeypatch.setattr(BlobMock, "upload_from_file", lambda blob, *args, **kwargs: uploads.append(blob.name) or
+                        upload_from_file(blob, *args, **kwargs))
+    for song_id in [CONTENT_NOT_FOUND_ID, SONG_AND_CONTENT_OK, SONG_AND_CONTENT_OK]:
+        response = client.post(f"/songs/{song_id}/content", files={"file": ("file.mp3", io.StringIO("same content"))})
+        assert response.status_code == 201
+    assert uploads == ["content/{}.mp3".format(hashlib.sha256(b"same content").hexdigest())]
+    assert client.get(f"/songs/{CONTENT_NOT_FOUND_ID}/content").content == b"same content"
+    assert client.get(f"/songs/{SONG_AND_CONTENT_OK}/content").content == b"same content"
+
+
+def test_create_content_too_large(mongo_test, monkeypatch):
+    monkeypatch.setattr("service.content.MAX_UPLOAD_SIZE", 4)
+    f = io.StringIO("content")
+    response = client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
+    assert response.status_code == 413
+    assert conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})["status"] == StatusEnum.not_uploaded
+
+
+def test_create_content_too_large_rejected_before_reading(mongo_test, monkeypatch):
+    def upload(song_id, file):
+        raise AssertionError("the body should not be read")
+
+    monkeypatch.setattr("service.content.MAX_UPLOAD_SIZE", 4)
+    monkeypatch.setattr("routes.content.upload_song_content", upload)
+    f = io.BytesIO(b"\x00" * 128 * 1024)
+    response = client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Content is larger than 4 bytes"}
+
+
+def test_create_content_checksum_mismatch(mongo_test, monkeypatch):
+    monkeypatch.setattr(BlobMock, "reload", lambda blob: setattr(blob, "md5_hash", "corrupted"))
+    f = io.StringIO("content")
+    response = client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
+    assert response.status_code == 502
+    assert conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})["status"] == StatusEnum.not_uploaded
+    assert bucket.get_blob("content/{}.mp3".format(hashlib.sha256(b"content").hexdigest())).size == 0
+
+
 def test_get_content(mongo_test):
     response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
     assert response.status_code == 200
@@ -64,6 +158,185 @@ def test_get_content(mongo_test):
     assert response.headers["content-type"] == "audio/mpeg"
 
 
+def test_get_content_accepts_ranges(mongo_test):
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-length"] == "7"
+
+
+def test_get_content_range(mongo_test):
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=1-3"})
+    assert response.status_code == 206
+    assert response.content == b"ont"
+    assert response.headers["content-range"] == "bytes 1-3/7"
+    assert response.headers["content-type"] == "audio/mpeg"
+
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=4-"})
+    assert response.status_code == 206
+    assert response.content == b"ent"
+
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=-2"})
+    assert response.status_code == 206
+    assert response.content == b"nt"
+    assert response.headers["content-range"] == "bytes 5-6/7"
+
+
+def test_get_content_range_not_satisfiable(mongo_test):
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=7-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */7"
+
+
+def test_get_content_invalid_range_ignored(mongo_test):
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=3-1"})
+    assert response.status_code == 200
+    assert response.content == b"content"
+
+
+def test_get_content_streams_in_chunks(mongo_test, monkeypatch):
+    monkeypatch.setattr("routes.content.CHUNK_SIZE", 2)
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=1-5"})
+    assert response.content == b"onten"
+
+
+def test_get_content_not_modified(mongo_test):
+    f = io.StringIO("content")
+    client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", f)})
+    response = client.get(f"/songs/{CONTENT_NOT_FOUND_ID}/content")
+    tag = response.headers["etag"]
+    assert tag == '"{}"'.format(hashlib.sha256(b"content").hexdigest())
+
+    bucket.d.clear()
+    response = client.get(f"/songs/{CONTENT_NOT_FOUND_ID}/content", headers={"if-none-match": tag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == tag
+
+
+def test_get_content_cached(mongo_test):
+    client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    bucket.get_blob(f"{SONG_AND_CONTENT_OK}/{SONG_AND_CONTENT_OK}.mp3").c = b"changed"
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    assert response.status_code == 200
+    assert response.content == b"content"
+    assert response.headers["content-type"] == "audio/mpeg"
+
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=1-3"})
+    assert response.status_code == 206
+    assert response.content == b"ont"
+
+    info = client.get("/metrics").json()["content_cache"]
+    assert info["hits"] == 2
+    assert info["misses"] == 1
+    assert info["bytes_served"] == 10
+
+
+def test_get_content_cached_survives_eviction(mongo_test, monkeypatch):
+    client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    monkeypatch.setattr("routes.content.CHUNK_SIZE", 2)
+    read = service.content.read_song_content
+
+    def read_then_evict(blob, start, end):
+        chunk = read(blob, start, end)
+        service.content.clear_cache()
+        return chunk
+
+    monkeypatch.setattr("routes.content.read_song_content", read_then_evict)
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=1-6"})
+    assert response.content == b"ontent"
+
+
+def test_upload_invalidates_cached_content(mongo_test):
+    client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    f = io.StringIO("new content")
+    client.post(f"/songs/{SONG_AND_CONTENT_OK}/content", files={"file": ("file.mp3", f)})
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    assert response.content == b"new content"
+
+
+def test_upload_keeps_other_cache_fills(mongo_test):
+    blob = service.content.get_song_content_blob({"id": SONG_AND_CONTENT_OK})
+    writer = service.content.cache_writer({"id": SONG_AND_CONTENT_OK}, blob)
+    writer.write(b"content")
+    client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", io.StringIO("other"))})
+    assert writer.commit(blob.size)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+    for key in ["a", "b", "c"]:
+        cache.put(key, lambda path: pathlib.Path(path).write_bytes(b"1234"))
+        cache.get("a")
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.info()["size"] == 8
+
+
+def test_get_content_cache_filled_from_stream(mongo_test, monkeypatch):
+    reads = []
+    download_as_bytes = BlobMock.download_as_bytes
+
+    def counting(self, start=None, end=None):
+        reads.append((start, end))
+        return download_as_bytes(self, start, end)
+
+    monkeypatch.setattr(BlobMock, "download_as_bytes", counting)
+    monkeypatch.setattr(BlobMock, "download_to_filename", None)
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", headers={"range": "bytes=1-3"})
+    assert response.content == b"ont"
+    assert service.content.cache_info()["files"] == 0
+
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content")
+    assert response.content == b"content"
+    assert reads == [(1, 3), (0, 6)]
+    assert service.content.cache_info()["files"] == 1
+    assert client.get(f"/songs/{SONG_AND_CONTENT_OK}/content").content == b"content"
+    assert len(reads) == 2
+
+
+def test_disk_cache_writer_commits_complete_content(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=100)
+    writer = cache.writer("a")
+    assert cache.writer("a") is None
+    writer.write(b"12")
+    writer.write(b"34")
+    assert not writer.commit(size=5)
+    assert cache.get("a") is None
+
+    writer = cache.writer("a")
+    writer.write(b"1234")
+    writer.close()
+    assert cache.get("a") is None
+
+    writer = cache.writer("a")
+    writer.write(b"1234")
+    assert writer.commit(size=4)
+    assert pathlib.Path(cache.get("a")).read_bytes() == b"1234"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["a"]
+
+
+def test_get_content_redirect(mongo_test):
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content?redirect=true", allow_redirects=False)
+    assert response.status_code == 302
+
+    response = client.get(response.headers["location"])
+    assert response.status_code == 200
+    assert response.content == b"content"
+
+
+def test_get_content_redirect_large_files(mongo_test, monkeypatch):
+    monkeypatch.setattr("service.content.CONTENT_REDIRECT_MIN_SIZE", 5)
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content", allow_redirects=False)
+    assert response.status_code == 302
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content?redirect=false", allow_redirects=False)
+    assert response.status_code == 200
+
+
+def test_get_content_signed_url_expired(mongo_test, monkeypatch):
+    monkeypatch.setattr("service.content.SIGNED_URL_TTL", -1)
+    response = client.get(f"/songs/{SONG_AND_CONTENT_OK}/content?redirect=true")
+    assert response.status_code == 403
+
+
 def test_create_and_get_song_and_content(mongo_test):
     test_song = {"name": "test", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
     response = client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']})
@@ -91,4 +364,28 @@ def test_create_and_get_song_and_content(mongo_test):
     test_song['id'] = song_id
     test_song['status'] = 'active'
     test_song['artists'] = [str(TEST_ARTIST['name'])]
+    test_song['duration'] = None
+    test_song['bitrate'] = None
     assert json_response == test_song
+
+
+def test_create_content_mp3_metadata(mongo_test):
+    response = client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", io.BytesIO(MP3))})
+    assert response.status_code == 201
+    song = conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})
+    assert song["duration"] == round(200 * 1152 / 44100, 3)
+    assert song["bitrate"] == 128
+    assert song["seek_table"][0] == len(ID3_TAG)
+    assert len(song["seek_table"]) == 6
+
+
+def test_get_content_start(mongo_test):
+    client.post(f"/songs/{CONTENT_NOT_FOUND_ID}/content", files={"file": ("file.mp3", io.BytesIO(MP3))})
+    seek_table = conn.songs.find_one({"_id": ObjectId(CONTENT_NOT_FOUND_ID)})["seek_table"]
+    response = client.get(f"/songs/{CONTENT_NOT_FOUND_ID}/content?start=2.5")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {seek_table[2]}-{len(MP3) - 1}/{len(MP3)}"
+    assert response.content == MP3[seek_table[2]:]
+
+    assert client.get(f"/songs/{CONTENT_NOT_FOUND_ID}/content?start=60").status_code == 416
+    assert client.get(f"/songs/{SONG_AND_CONTENT_OK}/content?start=1").status_code == 400
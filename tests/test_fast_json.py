@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+
+from main import app
+from config.db import conn
+from models.song import SongModel
+import service.artist
+import service.subscription
+from utils import fast_json
+from tests.test_artists import TEST_ARTIST
+
+client = TestClient(app)
+
+
+@pytest.fixture()
+def mongo_test():
+    for collection in (conn.songs, conn.albums, conn.playlists, conn.artists, conn.subscriptions):
+        collection.delete_many({})
+    service.artist.clear_cache()
+    service.subscription.clear_cache()
+    conn.artists.insert_one(TEST_ARTIST)
+    headers = {'x-user-id': TEST_ARTIST['user_id']}
+    songs = client.post("/songs/batch", json=[{"name": f"song {i}", "genre": "rock"} for i in range(3)],
+                        headers=headers).json()
+    songs_ids = [song["id"] for song in songs]
+    conn.songs.update_many({}, {"$set": {"status": "active"}})
+    album = client.post("/albums", json={"name": "album", "artists": [str(TEST_ARTIST['_id'])], "songs": songs_ids,
+                                         "year": 2022}, headers=headers).json()
+    playlist = client.post("/playlists", json={"name": "playlist", "songs": songs_ids}, headers=headers).json()
+    return songs_ids, album["id"], playlist["id"]
+
+
+def _get_both(monkeypatch, url):
+    default = client.get(url)
+    monkeypatch.setattr(fast_json, "FAST_JSON_RESPONSES", True)
+    fast = client.get(url)
+    monkeypatch.setattr(fast_json, "FAST_JSON_RESPONSES", False)
+    return default, fast
+
+
+def test_fast_responses_match_default(mongo_test, monkeypatch):
+    songs_ids, album_id, playlist_id = mongo_test
+    for url in ["/songs", "/songs?q=song", f"/songs?ids={songs_ids[2]},{songs_ids[0]}", "/albums",
+                f"/albums/{album_id}/songs", "/playlists", f"/playlists/{playlist_id}/songs", "/artists"]:
+        default, fast = _get_both(monkeypatch, url)
+        assert fast.status_code == default.status_code == 200
+        assert fast.json() == default.json()
+        assert fast.json()
+
+
+def test_fast_responses_keep_headers(mongo_test, monkeypatch):
+    songs_ids, _, _ = mongo_test
+    missing = "625c9dcd232be00e5f827fff"
+    default, fast = _get_both(monkeypatch, f"/songs?limit=1&ids={songs_ids[0]},{missing}")
+    assert fast.headers["x-missing-ids"] == default.headers["x-missing-ids"] == missing
+    default, fast = _get_both(monkeypatch, "/songs?limit=1")
+    assert fast.headers["x-next-cursor"] == default.headers["x-next-cursor"]
+
+
+def test_shape_drops_internal_fields():
+    doc = {"id": "1", "name": "song", "artists": ["artist"], "genre": "rock", "status": "active",
+           "date_created": None, "search_keys": ["song"], "score": 3, "content_key": "content/abc.mp3"}
+    assert fast_json.shape([doc], SongModel) == [{
+        "id": "1", "name": "song", "artists": ["artist"], "genre": "rock", "status": "active",
+        "date_created": None, "date_uploaded": None, "duration": None, "bitrate": None
+    }]
+
+
+def test_shape_fails_on_missing_required_field():
+    doc = {"id": "1", "name": "song", "artists": ["artist"], "status": "active", "date_created": None}
+    with pytest.raises(KeyError):
+        fast_json.shape([doc], SongModel)
+
+
+def test_shape_renders_floats_like_model():
+    doc = {"id": "1", "name": "song", "artists": ["artist"], "genre": "rock", "status": "active",
+           "date_created": datetime.datetime(2022, 1, 1), "duration": 215, "bitrate": 320}
+    shaped = fast_json.shape([doc], SongModel)
+    assert ORJSONResponse(shaped).body == ORJSONResponse([jsonable_encoder(SongModel(**doc))]).body
@@ -0,0 +1,39 @@
+import pytest
+from pymongo import ASCENDING
+
+from config.db import conn
+from config.indexes import INDEXES, ensure_indexes, index_report
+
+
+@pytest.fixture()
+def mongo_test_indexes():
+    for collection in INDEXES:
+        conn[collection].drop_indexes()
+
+
+def test_index_report_missing(mongo_test_indexes):
+    report = index_report(conn)
+    assert report["songs"]["missing"] == sorted(index.document["name"] for index in INDEXES["songs"])
+    assert report["songs"]["extra"] == []
+
+
+def test_ensure_indexes(mongo_test_indexes):
+    ensure_indexes(conn)
+    ensure_indexes(conn)
+    report = index_report(conn)
+    assert all(not r["missing"] and not r["extra"] for r in report.values())
+
+
+def test_ensure_indexes_continues_after_failure(mongo_test_indexes):
+    # An index with a declared name but other options, as an older deploy could have left it
+    conn.albums.create_index([("year", ASCENDING)], name="artists_1")
+    created = ensure_indexes(conn)
+    assert "albums" not in created
+    report = index_report(conn)
+    assert all(not r["missing"] for collection, r in report.items() if collection != "albums")
+
+
+def test_index_report_extra(mongo_test_indexes):
+    ensure_indexes(conn)
+    conn.songs.create_index([("genre", ASCENDING)], name="genre_1")
+    assert index_report(conn)["songs"] == {"missing": [], "extra": ["genre_1"]}
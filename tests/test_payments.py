@@ -0,0 +1,102 @@
+import datetime
+import io
+from decimal import Decimal
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from main import app
+from config.db import conn
+import service.artist
+import service.content
+import service.payment
+from tests.test_artists import TEST_ARTIST, TEST_ARTIST_2
+
+client = TestClient(app)
+
+TEST_SONG_ID = "625c9dcd232be00e5f827f7c"
+
+
+@pytest.fixture()
+def mongo_test(monkeypatch):
+    monkeypatch.setattr(service.payment, "PAYMENTS_ENABLED", True)
+    conn.songs.delete_many({})
+    conn.artists.delete_many({})
+    conn.payments_outbox.delete_many({})
+    conn.plays.delete_many({})
+    service.artist.clear_cache()
+    service.content.clear_cache()
+    conn.artists.insert_one({**TEST_ARTIST, "subscription_level": 1})
+    conn.artists.insert_one({**TEST_ARTIST_2, "subscription_level": 3})
+    conn.songs.insert_one({"_id": ObjectId(TEST_SONG_ID), "status": "active",
+                           "artists": [TEST_ARTIST["_id"], TEST_ARTIST_2["_id"]]})
+    client.post(f"/songs/{TEST_SONG_ID}/content", files={"file": ("file.mp3", io.StringIO("content"))})
+
+
+class StubPaymentService:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.payments = []
+
+    def __call__(self, artist_id, amount):
+        if self.fail:
+            raise ConnectionError("payment service unavailable")
+        self.payments.append((artist_id, amount))
+
+
+def test_download_enqueues_payments(mongo_test):
+    response = client.get(f"/songs/{TEST_SONG_ID}/content")
+    assert response.status_code == 200
+    payments = {p["artist_id"]: p["amount"] for p in conn.payments_outbox.find()}
+    assert payments == {TEST_ARTIST["user_id"]: "0.00000005", TEST_ARTIST_2["user_id"]: "0.00000015"}
+
+
+def test_ranged_download_paid(mongo_test):
+    client.get(f"/songs/{TEST_SONG_ID}/content", headers={"range": "bytes=1-"})
+    assert conn.payments_outbox.count_documents({}) == 2
+
+
+def test_download_paid_once_per_window(mongo_test):
+    headers = {"x-user-id": "listener@test.com"}
+    client.get(f"/songs/{TEST_SONG_ID}/content", headers=headers)
+    client.get(f"/songs/{TEST_SONG_ID}/content", headers={**headers, "range": "bytes=3-"})
+    assert conn.payments_outbox.count_documents({}) == 2
+    client.get(f"/songs/{TEST_SONG_ID}/content", headers={"x-user-id": "other@test.com"})
+    assert conn.payments_outbox.count_documents({}) == 4
+
+    conn.plays.update_many({}, {"$set": {"expires_at": datetime.datetime.utcnow()}})
+    client.get(f"/songs/{TEST_SONG_ID}/content", headers=headers)
+    assert conn.payments_outbox.count_documents({}) == 6
+
+
+def test_dispatch_aggregates_per_artist(mongo_test):
+    for _ in range(3):
+        client.get(f"/songs/{TEST_SONG_ID}/content")
+    stub = StubPaymentService()
+    assert service.payment.dispatch(stub) == 6
+    assert sorted(stub.payments) == sorted([(TEST_ARTIST["user_id"], Decimal("0.00000015")),
+                                            (TEST_ARTIST_2["user_id"], Decimal("0.00000045"))])
+    assert conn.payments_outbox.count_documents({}) == 0
+
+
+def test_dispatch_retries_with_backoff(mongo_test):
+    client.get(f"/songs/{TEST_SONG_ID}/content")
+    assert service.payment.dispatch(StubPaymentService(fail=True)) == 0
+    payment = conn.payments_outbox.find_one()
+    assert payment["status"] == service.payment.PENDING
+    assert payment["attempts"] == 1
+    assert payment["next_attempt_at"] > datetime.datetime.utcnow()
+
+    stub = StubPaymentService()
+    assert service.payment.dispatch(stub) == 0
+    conn.payments_outbox.update_many({}, {"$set": {"next_attempt_at": datetime.datetime.utcnow()}})
+    assert service.payment.dispatch(stub) == 2
+    assert len(stub.payments) == 2
+
+
+def test_download_not_queued_without_dispatcher(mongo_test, monkeypatch):
+    monkeypatch.setattr(service.payment, "PAYMENTS_ENABLED", False)
+    assert client.get(f"/songs/{TEST_SONG_ID}/content", headers={"x-user-id": "listener@test.com"}).status_code == 200
+    assert conn.payments_outbox.count_documents({}) == 0
+    assert conn.plays.count_documents({}) == 0
@@ -2,6 +2,8 @@ import pytest
 from bson import ObjectId
 import datetime
 from main import app
+from models.playlist import CreatePlaylistRequest
+import service.playlist
 from fastapi.testclient import TestClient
 from config.db import conn
 
@@ -80,6 +82,29 @@ def test_create_playlist(mongo_test_full):
     assert response.json()["owner"] == TEST_PLAYLIST["owner"]
 
 
+def test_create_playlist_no_read_after_insert(mongo_test_full, mongo_commands):
+    playlist = CreatePlaylistRequest(name="test", songs=[str(TEST_SONG_1["_id"])])
+    created = service.playlist.create(playlist, TEST_PLAYLIST["owner"])
+    assert mongo_commands == ["insert"]
+    assert created["songs"] == [str(TEST_SONG_1["_id"])]
+    assert created["owner"] == TEST_PLAYLIST["owner"]
+    assert "search_keys" not in created
+
+
+def test_create_playlist_invalid_songs(mongo_test_full):
+    conn.songs.update_one({"_id": TEST_SONG_2["_id"]}, {"$set": {"status": "inactive"}})
+    missing_id = "625c9dcd232be00e5f827fff"
+    test_playlist = {"name": "test", "songs": [str(TEST_SONG_1["_id"]), missing_id, str(TEST_SONG_2["_id"]), "123"]}
+    response = client.post("/playlists", json=test_playlist, headers={"x-user-id": TEST_PLAYLIST["owner"]})
+    assert response.status_code == 404
+    assert response.json()["detail"] == [
+        {"song_id": missing_id, "status_code": 404, "detail": f"Song {missing_id} not found"},
+        {"song_id": str(TEST_SONG_2["_id"]), "status_code": 400, "detail": f"Song {TEST_SONG_2['_id']} not available"},
+        {"song_id": "123", "status_code": 400, "detail": "Song ID '123' is not valid"},
+    ]
+    assert conn.playlists.count_documents({}) == 1
+
+
 def test_get_all_playlists(mongo_test_songs):
     test_playlist = {"name": "test", "songs": [str(TEST_SONG_1["_id"]), str(TEST_SONG_2["_id"])]}
     for i in range(10):
@@ -89,6 +114,16 @@ def test_get_all_playlists(mongo_test_songs):
     assert len(response.json()) == 10
 
 
+def test_get_playlists_paginated(mongo_test_songs):
+    test_playlist = {"name": "test", "songs": [str(TEST_SONG_1["_id"])]}
+    created = [client.post("/playlists", json=test_playlist, headers={"x-user-id": TEST_PLAYLIST["owner"]}).json()["id"]
+               for _ in range(3)]
+    response = client.get("/playlists", params={"limit": 2})
+    assert [playlist["id"] for playlist in response.json()] == created[:2]
+    response = client.get("/playlists", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [playlist["id"] for playlist in response.json()] == created[2:]
+
+
 def test_find_playlist(mongo_test_songs):
     test_playlist1 = {
         "name": "rock nacional",
@@ -154,6 +189,19 @@ def test_add_song_to_playlist_not_found_fails(mongo_test_songs):
     assert response.status_code == 404
 
 
+def test_add_song_not_owner_fails(mongo_test_full):
+    response = client.post("/playlists/{}".format(str(TEST_PLAYLIST["_id"])), json={"songs": [str(TEST_SONG_3["_id"])]},
+                           headers={"x-user-id": "other_user"})
+    assert response.status_code == 400
+    assert len(conn.playlists.find_one({"_id": TEST_PLAYLIST["_id"]})["songs"]) == len(TEST_PLAYLIST["songs"])
+
+
+def test_add_song_playlist_not_found_fails(mongo_test_songs):
+    response = client.post("/playlists/{}".format(str(TEST_PLAYLIST["_id"])), json={"songs": [str(TEST_SONG_3["_id"])]},
+                           headers={"x-user-id": TEST_PLAYLIST["owner"]})
+    assert response.status_code == 404
+
+
 def test_delete_song(mongo_test_full):
     response = client.delete("/playlists/{}/delete/{}".format(str(TEST_PLAYLIST["_id"]),
                                                               str(TEST_PLAYLIST["songs"][0])),
@@ -164,6 +212,13 @@ def test_delete_song(mongo_test_full):
     assert json_response["songs"] == expected_songs
 
 
+def test_delete_song_not_owner_fails(mongo_test_full):
+    response = client.delete("/playlists/{}/delete/{}".format(str(TEST_PLAYLIST["_id"]),
+                                                              str(TEST_PLAYLIST["songs"][0])),
+                             headers={"x-user-id": "other_user"})
+    assert response.status_code == 400
+
+
 def test_update_playlist(mongo_test_full):
     updated_playlist = {
         "name": "updated_name",
@@ -199,3 +254,17 @@ def test_delete_playlist_not_found_fails(mongo_test_empty):
 def test_get_invalid_id_fails(mongo_test_full):
     response_get = client.get("/playlists/{}".format("123"))
     assert response_get.status_code == 400
+
+
+def test_get_playlist_entitlements(mongo_test_full):
+    conn.songs.update_one({"_id": TEST_SONG_2["_id"]}, {"$set": {"subscription_level": 2}})
+    response = client.get("/playlists/{}/entitlements".format(TEST_PLAYLIST["_id"]),
+                          headers={"x-user-id": "free@test.com"})
+    assert response.status_code == 200
+    assert response.json() == {str(TEST_SONG_1["_id"]): True, str(TEST_SONG_2["_id"]): False}
+
+    conn.subscriptions.insert_one({"user_id": "premium@test.com", "subscription_type_level": 2})
+    response = client.get("/playlists/{}/entitlements".format(TEST_PLAYLIST["_id"]),
+                          headers={"x-user-id": "premium@test.com"})
+    assert response.json() == {str(TEST_SONG_1["_id"]): True, str(TEST_SONG_2["_id"]): True}
+    conn.subscriptions.delete_many({})
@@ -1,11 +1,18 @@
 import pytest
 from bson import ObjectId
 import datetime
+import json
 from fastapi.testclient import TestClient
 
 from main import app
+from models.song import CreateSongRequest
 from config.db import conn
-from tests.test_artists import TEST_ARTIST
+from config.indexes import ensure_indexes
+import service.artist
+import service.song
+import service.subscription
+from utils import search
+from tests.test_artists import TEST_ARTIST, TEST_ARTIST_2
 
 TEST_SONG = {
     "_id": ObjectId("625c9dcd232be00e5f827f6a"),
@@ -26,6 +33,10 @@ client = TestClient(app)
 def mongo_test_empty():
     conn.songs.delete_many({})
     conn.artists.delete_many({})
+    conn.subscriptions.delete_many({})
+    conn.subscription_invalidations.delete_many({})
+    service.artist.clear_cache()
+    service.subscription.clear_cache()
 
 
 @pytest.fixture()
@@ -39,6 +50,48 @@ def mongo_test_artist(mongo_test_empty):
     conn.artists.insert_one(TEST_ARTIST)
 
 
+# Songs of another artist, so a scan of _id_ with a filter does more work than the index under test
+OTHER_SONGS = 200
+
+
+@pytest.fixture()
+def mongo_test_indexed(mongo_test):
+    conn.songs.insert_many([{**TEST_SONG, "_id": ObjectId(), "name": f"other {i}", "artists": [TEST_ARTIST_2["_id"]],
+                             search.KEYS_FIELD: search.keys(f"other {i}")} for i in range(OTHER_SONGS)])
+    ensure_indexes(conn)
+
+
+def _winning_plans(explain):
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _winning_plans(value)
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _uses_index(pipeline, index_name, collection="songs"):
+    # Needs the query planner of a real mongod, which pymongo_inmemory provides
+    explain = conn.command("aggregate", collection, pipeline=pipeline, explain=True)
+    stages = [stage for plan in _winning_plans(explain) for stage in _stages(plan)]
+    scanned = {stage.get("indexName") for stage in stages if stage["stage"] == "IXSCAN"}
+    return index_name in scanned and all(stage["stage"] != "COLLSCAN" for stage in stages)
+
+
 def test_get_all_songs_empty(mongo_test_empty):
     response = client.get("/songs")
     assert response.status_code == 200
@@ -55,6 +108,15 @@ def test_create_song(mongo_test):
     response.json()["genre"] = test_song["genre"]
 
 
+def test_create_song_no_read_after_insert(mongo_test_artist, mongo_commands):
+    service.artist.get(user_id=TEST_ARTIST['user_id'])
+    mongo_commands.clear()
+    creates = 100
+    for i in range(creates):
+        service.song.create(CreateSongRequest(name=f"song {i}", genre="rock"), TEST_ARTIST['user_id'])
+    assert mongo_commands == ["find", "insert"] * creates
+
+
 def test_get_all_songs(mongo_test_artist):
     test_song = {"name": "test", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
     for i in range(10):
@@ -64,6 +126,51 @@ def test_get_all_songs(mongo_test_artist):
     assert len(response.json()) == 10
 
 
+def test_get_songs_paginated(mongo_test_artist):
+    test_song = {"name": "test", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
+    created = [client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']}).json()["id"]
+               for _ in range(5)]
+    response = client.get("/songs", params={"limit": 2})
+    assert [song["id"] for song in response.json()] == created[:2]
+    response = client.get("/songs", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [song["id"] for song in response.json()] == created[2:4]
+    response = client.get("/songs", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [song["id"] for song in response.json()] == created[4:]
+    assert "x-next-cursor" not in response.headers
+
+
+def test_get_songs_ndjson(mongo_test_artist):
+    test_song = {"name": "test", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
+    for i in range(3):
+        client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs", headers={"accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert all(song["artists"] == [TEST_ARTIST['name']] for song in lines)
+    assert lines[0]["name"] == test_song["name"]
+
+
+def test_get_songs_invalid_cursor_fails(mongo_test_empty):
+    response = client.get("/songs", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_get_all_songs_artists_names(mongo_test_artist):
+    conn.artists.insert_one(TEST_ARTIST_2)
+    test_song1 = {"name": "test", "artists": [str(TEST_ARTIST_2['_id']), str(TEST_ARTIST['_id'])], "genre": "rock"}
+    test_song2 = {"name": "test", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
+    client.post("/songs", json=test_song1, headers={'x-user-id': TEST_ARTIST['user_id']})
+    client.post("/songs", json=test_song2, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs")
+    assert response.status_code == 200
+    assert [song["artists"] for song in response.json()] == [
+        [TEST_ARTIST_2['name'], TEST_ARTIST['name']],
+        [TEST_ARTIST['name']]
+    ]
+
+
 def test_find_song(mongo_test_artist):
     test_song1 = {"name": "Across the universe", "artists": [], "genre": "rock"}
     test_song2 = {"name": "On the run", "artists": [], "genre": "rock"}
@@ -81,6 +188,264 @@ def test_find_song(mongo_test_artist):
     assert len(response2.json()) == 0
 
 
+def test_find_song_by_artist_name(mongo_test_artist):
+    conn.artists.insert_one(TEST_ARTIST_2)
+    search.reindex(conn.artists, service.artist.SEARCH_FIELDS)
+    test_song1 = {"name": "Money", "artists": [str(TEST_ARTIST['_id'])], "genre": "rock"}
+    test_song2 = {"name": "Time", "artists": [str(TEST_ARTIST_2['_id'])], "genre": "rock"}
+    client.post("/songs", json=test_song1, headers={'x-user-id': TEST_ARTIST['user_id']})
+    client.post("/songs", json=test_song2, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs", params={"q": "band 2"})
+    assert [song["name"] for song in response.json()] == ["Time"]
+
+
+def test_find_song_ranked(mongo_test_artist):
+    for name in ["Brain damage", "Eclipse", "Total eclipse of the heart"]:
+        test_song = {"name": name, "artists": [], "genre": "rock"}
+        client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs", params={"q": "eclipse"})
+    assert [song["name"] for song in response.json()] == ["Eclipse", "Total eclipse of the heart"]
+    response = client.get("/songs", params={"q": "eclipse", "limit": 1})
+    assert [song["name"] for song in response.json()] == ["Eclipse"]
+    response = client.get("/songs", params={"q": "eclipse", "limit": 1, "cursor": response.headers["x-next-cursor"]})
+    assert [song["name"] for song in response.json()] == ["Total eclipse of the heart"]
+
+
+def test_find_song_ranked_pages_keep_rank(mongo_test_artist):
+    # The best match is created last, so only the rank in the cursor can bring the older song to the next page
+    for name in ["Total eclipse of the heart", "Eclipse"]:
+        client.post("/songs", json={"name": name, "genre": "rock"}, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs", params={"q": "eclipse", "limit": 1})
+    assert [song["name"] for song in response.json()] == ["Eclipse"]
+    response = client.get("/songs", params={"q": "eclipse", "limit": 1, "cursor": response.headers["x-next-cursor"]})
+    assert [song["name"] for song in response.json()] == ["Total eclipse of the heart"]
+
+
+def _page_names(params, pages=10):
+    names = []
+    cursor = None
+    for _ in range(pages):
+        response = client.get("/songs", params={**params, **({"cursor": cursor} if cursor else {})})
+        names += [song["name"] for song in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    return names
+
+
+def test_find_song_ranked_pages_non_ascii_name(mongo_test_artist):
+    names = ["CANCIÓN", "canción triste", "otra canción"]
+    for name in names:
+        client.post("/songs", json={"name": name, "genre": "rock"}, headers={'x-user-id': TEST_ARTIST['user_id']})
+    assert sorted(_page_names({"q": "canción", "limit": 1})) == sorted(names)
+
+
+def test_find_song_ranked_pages_stale_search_keys(mongo_test_artist):
+    conn.artists.update_one({"_id": TEST_ARTIST["_id"]},
+                            {"$set": {search.KEYS_FIELD: search.keys(TEST_ARTIST["name"])}})
+    client.post("/songs", json={"name": "band", "genre": "rock"}, headers={'x-user-id': TEST_ARTIST['user_id']})
+    # Created before search keys, matched only through its artist
+    conn.songs.insert_one({**TEST_SONG, "_id": ObjectId(), "name": "Band anthem", "artists": [TEST_ARTIST["_id"]]})
+    assert _page_names({"q": "band", "limit": 1}) == ["band", "Band anthem"]
+
+
+def test_find_song_without_score(mongo_test):
+    assert all(search.SCORE_FIELD not in song for song in client.get("/songs", params={"q": "test"}).json())
+
+
+def test_find_song_no_words_is_no_filter(mongo_test):
+    response = client.get("/songs", params={"q": "!!"})
+    assert [song["id"] for song in response.json()] == [str(TEST_SONG["_id"])]
+
+
+def test_find_song_regex_characters(mongo_test_artist):
+    test_song = {"name": "(a+)+$", "artists": [], "genre": "rock"}
+    client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs", params={"q": "(a+)+$"})
+    assert response.status_code == 200
+    assert [song["name"] for song in response.json()] == ["(a+)+$"]
+
+
+def test_find_song_reindexed(mongo_test):
+    response = client.get("/songs", params={"q": "test"})
+    assert len(response.json()) == 0
+    search.reindex(conn.songs, service.song.SEARCH_FIELDS)
+    response = client.get("/songs", params={"q": "test"})
+    assert [song["id"] for song in response.json()] == [str(TEST_SONG["_id"])]
+
+
+def test_find_song_subscription_level(mongo_test_empty):
+    conn.artists.insert_one({**TEST_ARTIST, "subscription_level": 2})
+    conn.songs.insert_one(TEST_SONG)
+    service.artist.refresh_denormalized()
+    response = client.get("/songs", headers={'x-user-id': "free@test.com"})
+    assert response.json() == []
+    conn.subscriptions.insert_one({"user_id": "premium@test.com", "subscription_type_level": 2})
+    response = client.get("/songs", headers={'x-user-id': "premium@test.com"})
+    assert [song["id"] for song in response.json()] == [str(TEST_SONG["_id"])]
+    conn.subscriptions.delete_many({})
+
+
+def test_find_song_subscription_level_cached(mongo_test_empty):
+    conn.artists.insert_one({**TEST_ARTIST, "subscription_level": 2})
+    conn.songs.insert_one(TEST_SONG)
+    service.artist.refresh_denormalized()
+    assert client.get("/songs", headers={'x-user-id': "upgrade@test.com"}).json() == []
+    conn.subscriptions.insert_one({"user_id": "upgrade@test.com", "subscription_type_level": 2})
+    assert client.get("/songs", headers={'x-user-id': "upgrade@test.com"}).json() == []
+    assert service.subscription.cache_info()["hits"] == 1
+
+    response = client.delete("/subscriptions/upgrade@test.com/cache")
+    assert response.status_code == 204
+    response = client.get("/songs", headers={'x-user-id': "upgrade@test.com"})
+    assert [song["id"] for song in response.json()] == [str(TEST_SONG["_id"])]
+
+
+def test_subscription_invalidated_by_other_worker(mongo_test_empty, monkeypatch):
+    monkeypatch.setattr(service.subscription, "INVALIDATION_POLL_INTERVAL", 0)
+    assert service.subscription.get_level("upgrade@test.com") == 0
+    conn.subscriptions.insert_one({"user_id": "upgrade@test.com", "subscription_type_level": 2})
+    assert service.subscription.get_level("upgrade@test.com") == 0
+    # Another worker handled the invalidation route, only the shared log reaches this one
+    conn.subscription_invalidations.insert_one({"user_id": "upgrade@test.com", "at": datetime.datetime.utcnow()})
+    assert service.subscription.get_level("upgrade@test.com") == 2
+
+
+def test_subscription_invalidation_applied_once(mongo_test_empty, monkeypatch):
+    monkeypatch.setattr(service.subscription, "INVALIDATION_POLL_INTERVAL", 0)
+    service.subscription.invalidate("upgrade@test.com")
+    conn.subscription_invalidations.insert_one({"user_id": "other@test.com", "at": datetime.datetime.utcnow()})
+    for _ in range(5):
+        service.subscription.get_level("upgrade@test.com")
+        service.subscription.get_level("other@test.com")
+    info = service.subscription.cache_info()
+    assert (info["hits"], info["misses"]) == (8, 2)
+
+
+def test_find_songs_pipeline_filters_first():
+    pipeline = service.song._pipeline(artist_id=str(TEST_ARTIST["_id"]), subscription_level=1, limit=10)
+    assert pipeline[0] == {"$match": {"artists": TEST_ARTIST["_id"], "subscription_level": {"$not": {"$gt": 1}}}}
+    assert not any("$lookup" in stage for stage in pipeline)
+    stages = [next(iter(stage)) for stage in pipeline]
+    assert stages.index("$match") < stages.index("$sort") < stages.index("$limit")
+
+
+def test_song_denormalized_artists(mongo_test_artist):
+    conn.artists.insert_one(TEST_ARTIST_2)
+    test_song = {"name": "test", "artists": [str(TEST_ARTIST['_id']), str(TEST_ARTIST_2['_id'])], "genre": "rock"}
+    song_id = client.post("/songs", json=test_song, headers={'x-user-id': TEST_ARTIST['user_id']}).json()["id"]
+    song = conn.songs.find_one({"_id": ObjectId(song_id)})
+    assert song["artists_names"] == [TEST_ARTIST['name'], TEST_ARTIST_2['name']]
+    assert song["subscription_level"] == 0
+
+    client.put("/artists/{}".format(TEST_ARTIST_2['_id']), json={"name": "renamed", "subscription_level": 3})
+    song = conn.songs.find_one({"_id": ObjectId(song_id)})
+    assert song["artists_names"] == [TEST_ARTIST['name'], "renamed"]
+    assert song["subscription_level"] == 3
+
+    client.delete("/artists/{}".format(TEST_ARTIST_2['_id']))
+    response = client.get("/songs/{}".format(song_id))
+    assert response.json()["artists"] == [TEST_ARTIST['name']]
+    assert conn.songs.find_one({"_id": ObjectId(song_id)})["subscription_level"] == 0
+
+
+def test_find_songs_pipelines_match_indexed_fields():
+    # What the explain tests below rely on, checked without a query planner
+    by_ids = service.song._pipeline(songs_ids=[str(TEST_SONG["_id"])], subscription_level=0)
+    assert by_ids[0]["$match"]["_id"] == {"$in": [TEST_SONG["_id"]]}
+    by_name = service.song._pipeline(q="test", subscription_level=0)
+    assert by_name[0]["$match"]["$or"][0] == {search.KEYS_FIELD: {"$all": ["test"]}}
+
+
+def test_find_songs_by_artist_uses_index(mongo_test_indexed):
+    assert _uses_index(service.song._pipeline(artist_id=str(TEST_ARTIST["_id"]), subscription_level=0), "artists_1")
+
+
+def test_find_songs_by_ids_uses_index(mongo_test_indexed):
+    assert _uses_index(service.song._pipeline(songs_ids=[str(TEST_SONG["_id"])], subscription_level=0), "_id_")
+
+
+def test_find_songs_by_name_uses_index(mongo_test_indexed):
+    assert _uses_index(service.song._pipeline(q="test", subscription_level=0), f"{search.KEYS_FIELD}_1")
+
+
+def test_get_songs_by_ids(mongo_test):
+    other = conn.songs.insert_one({**TEST_SONG, "_id": ObjectId(), "name": "other"}).inserted_id
+    missing = "625c9dcd232be00e5f827fff"
+    response = client.get("/songs", params={"ids": f"{other},{missing},{TEST_SONG['_id']},{other}"})
+    assert response.status_code == 200
+    assert [song["id"] for song in response.json()] == [str(other), str(TEST_SONG["_id"])]
+    assert response.json()[0]["artists"] == [TEST_ARTIST["name"]]
+    assert response.headers["x-missing-ids"] == missing
+
+
+def test_get_songs_by_ids_subscription_level(mongo_test):
+    conn.songs.update_one({"_id": TEST_SONG["_id"]}, {"$set": {"subscription_level": 2}})
+    response = client.get("/songs", params={"ids": str(TEST_SONG["_id"])})
+    assert response.json() == []
+    assert response.headers["x-missing-ids"] == str(TEST_SONG["_id"])
+
+
+def test_get_songs_by_invalid_ids_fails(mongo_test):
+    assert client.get("/songs", params={"ids": f"{TEST_SONG['_id']},123"}).status_code == 400
+    assert client.get("/songs", params={"ids": ","}).status_code == 400
+
+
+def test_create_songs_batch(mongo_test):
+    conn.artists.insert_one(TEST_ARTIST_2)
+    songs = [
+        {"name": "first", "genre": "rock"},
+        {"name": "second", "genre": "pop", "artists": [str(TEST_ARTIST_2["_id"])]},
+        {"name": "third", "genre": "jazz", "artists": [str(TEST_ARTIST["_id"]), str(TEST_ARTIST_2["_id"])]},
+    ]
+    response = client.post("/songs/batch", json=songs, headers={'x-user-id': TEST_ARTIST['user_id']})
+    assert response.status_code == 201
+    created = response.json()
+    assert [song["name"] for song in created] == ["first", "second", "third"]
+    assert [song["artists"] for song in created] == [
+        [str(TEST_ARTIST["_id"])], [str(TEST_ARTIST_2["_id"])], [str(TEST_ARTIST["_id"]), str(TEST_ARTIST_2["_id"])]
+    ]
+    assert conn.songs.count_documents({"_id": {"$in": [ObjectId(song["id"]) for song in created]}}) == 3
+
+
+def test_create_songs_batch_no_read_after_insert(mongo_test, mongo_commands):
+    service.artist.get(user_id=TEST_ARTIST['user_id'])
+    mongo_commands.clear()
+    songs = [CreateSongRequest(name=f"song {i}", genre="rock") for i in range(100)]
+    assert len(service.song.create_many(songs, TEST_ARTIST['user_id'])) == 100
+    assert mongo_commands == ["find", "insert"]
+
+
+def test_create_song_denormalizes_from_database(mongo_test_artist):
+    service.artist.get(user_id=TEST_ARTIST['user_id'])
+    # Another worker raised the artist level, this worker still has the old artist cached
+    conn.artists.update_one({"_id": TEST_ARTIST["_id"]}, {"$set": {"subscription_level": 2, "name": "renamed"}})
+    song = service.song.create(CreateSongRequest(name="song", genre="rock"), TEST_ARTIST['user_id'])
+    stored = conn.songs.find_one({"_id": ObjectId(song["id"])})
+    assert stored["subscription_level"] == 2
+    assert stored["artists_names"] == ["renamed"]
+
+
+def test_create_song_returns_stored_dates(mongo_test_artist):
+    song = service.song.create(CreateSongRequest(name="song", genre="rock"), TEST_ARTIST['user_id'])
+    stored = conn.songs.find_one({"_id": ObjectId(song["id"])})
+    assert song["date_created"] == stored["date_created"]
+    assert song["updated_at"] == stored["updated_at"]
+    assert song["date_created"].microsecond % 1000 == 0
+
+
+def test_create_songs_batch_unknown_artist_fails(mongo_test):
+    songs = [{"name": "first", "genre": "rock"}, {"name": "second", "genre": "pop", "artists": [str(TEST_ARTIST_2["_id"])]}]
+    response = client.post("/songs/batch", json=songs, headers={'x-user-id': TEST_ARTIST['user_id']})
+    assert response.status_code == 404
+    assert conn.songs.count_documents({}) == 1
+
+
+def test_create_songs_batch_empty_fails(mongo_test):
+    response = client.post("/songs/batch", json=[], headers={'x-user-id': TEST_ARTIST['user_id']})
+    assert response.status_code == 422
+
+
 def test_get_song_not_found(mongo_test):
     song_id = "625c9dcd232be00e5f827f7b"
     response = client.get("/songs/{}".format(song_id))
@@ -97,11 +462,35 @@ def test_get_song(mongo_test):
     expected_response = TEST_SONG.copy()
     expected_response['id'] = str(expected_response['_id'])
     expected_response['artists'] = [TEST_ARTIST['name']]
+    expected_response['duration'] = None
+    expected_response['bitrate'] = None
     del expected_response["_id"]
     del expected_response["date_created"]
     assert json_response == expected_response
 
 
+def test_get_song_not_modified(mongo_test):
+    response = client.get("/songs/{}".format(str(TEST_SONG["_id"])))
+    tag = response.headers["etag"]
+    response = client.get("/songs/{}".format(str(TEST_SONG["_id"])), headers={"if-none-match": tag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == tag
+
+    client.put("/songs/{}".format(str(TEST_SONG["_id"])), json={"name": "updated_name"},
+               headers={'x-user-id': TEST_ARTIST['user_id']})
+    response = client.get("/songs/{}".format(str(TEST_SONG["_id"])), headers={"if-none-match": tag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != tag
+    last_modified = response.headers["last-modified"]
+
+    response = client.get("/songs/{}".format(str(TEST_SONG["_id"])), headers={"if-modified-since": last_modified})
+    assert response.status_code == 304
+    response = client.get("/songs/{}".format(str(TEST_SONG["_id"])),
+                          headers={"if-modified-since": "Mon, 01 Jan 2001 00:00:00 GMT"})
+    assert response.status_code == 200
+
+
 def test_update_song(mongo_test):
     updated_song = {"name": "updated_name"}
     response = client.put("/songs/{}".format(str(TEST_SONG["_id"])), json=updated_song,
@@ -119,6 +508,24 @@ def test_update_song_not_found_fails(mongo_test_empty):
     assert response.status_code == 404
 
 
+def test_update_song_not_owner_fails(mongo_test, monkeypatch):
+    async def not_admin(user_id, authorization):
+        return False
+    monkeypatch.setattr("routes.song.is_admin", not_admin)
+    conn.artists.insert_one(TEST_ARTIST_2)
+    response = client.put("/songs/{}".format(str(TEST_SONG["_id"])), json={"name": "updated_name"},
+                          headers={'x-user-id': TEST_ARTIST_2['user_id']})
+    assert response.status_code == 400
+    assert conn.songs.find_one({"_id": TEST_SONG["_id"]})["name"] == TEST_SONG["name"]
+
+
+def test_update_song_by_admin(mongo_test):
+    response = client.put("/songs/{}".format(str(TEST_SONG["_id"])), json={"name": "updated_name"},
+                          headers={'x-user-id': 'admin@test.com'})
+    assert response.status_code == 200
+    assert response.json()["name"] == "updated_name"
+
+
 def test_delete_song(mongo_test):
     response = client.delete("/songs/{}".format(TEST_SONG["_id"]),
                              headers={'x-user-id': TEST_ARTIST['user_id']})
@@ -134,6 +541,15 @@ def test_delete_song_not_found_fails(mongo_test_empty):
     assert response.status_code == 404
 
 
+def test_delete_song_not_owner_fails(mongo_test, monkeypatch):
+    async def not_admin(user_id, authorization):
+        return False
+    monkeypatch.setattr("routes.song.is_admin", not_admin)
+    response = client.delete("/songs/{}".format(TEST_SONG["_id"]), headers={'x-user-id': 'other@test.com'})
+    assert response.status_code == 400
+    assert conn.songs.count_documents({"_id": TEST_SONG["_id"]}) == 1
+
+
 def test_get_invalid_id_fails(mongo_test):
     response_get = client.get("/songs/{}".format("123"))
     assert response_get.status_code == 400
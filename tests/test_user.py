@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+import pytest
+
+import utils.user
+
+
+@pytest.fixture()
+def users_api(monkeypatch):
+    calls = []
+
+    async def fetch(user_id, token_authorization):
+        calls.append(user_id)
+        await asyncio.sleep(0.01)
+        if user_id == "down@test.com":
+            raise httpx.ConnectTimeout("timed out")
+        return user_id == "admin@test.com"
+
+    monkeypatch.setattr(utils.user, "test", False)
+    monkeypatch.setattr(utils.user, "_fetch_is_admin", fetch)
+    utils.user.clear_cache()
+    return calls
+
+
+def test_is_admin_single_flight(users_api):
+    async def check():
+        return await asyncio.gather(*(utils.user.is_admin("admin@test.com", "token") for _ in range(5)))
+
+    assert asyncio.run(check()) == [True] * 5
+    assert users_api == ["admin@test.com"]
+
+
+def test_is_admin_cached(users_api):
+    assert asyncio.run(utils.user.is_admin("user@test.com", "token")) is False
+    assert asyncio.run(utils.user.is_admin("user@test.com", "token")) is False
+    assert users_api == ["user@test.com"]
+    assert utils.user.cache_info()["hits"] == 1
+
+
+def test_is_admin_users_api_down(users_api):
+    assert asyncio.run(utils.user.is_admin("down@test.com", "token")) is False
+    assert asyncio.run(utils.user.is_admin("down@test.com", "token")) is False
+    assert users_api == ["down@test.com", "down@test.com"]
+
+
+@pytest.fixture()
+def users_api_transport(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        user_id = request.url.path.rsplit("/", 1)[-1]
+        if user_id == "list@test.com":
+            return httpx.Response(200, json=["not", "a", "user"])
+        if user_id == "error@test.com":
+            return httpx.Response(503, json={"detail": "unavailable"})
+        return httpx.Response(200, json={"user_type": "admin" if user_id == "admin@test.com" else "listener"})
+
+    monkeypatch.setattr(utils.user, "test", False)
+    monkeypatch.delenv("BACKOFFICE_API_KEY", raising=False)
+    monkeypatch.setattr(utils.user, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    utils.user.clear_cache()
+    return requests
+
+
+def test_is_admin_without_authorization(users_api_transport):
+    assert asyncio.run(utils.user.is_admin("admin@test.com", None)) is True
+    assert "authorization" not in users_api_transport[0].headers
+    assert "x-api-key" not in users_api_transport[0].headers
+
+
+def test_is_admin_unexpected_body(users_api_transport):
+    assert asyncio.run(utils.user.is_admin("list@test.com", "token")) is False
+
+
+def test_is_admin_error_status_not_cached(users_api_transport):
+    assert asyncio.run(utils.user.is_admin("error@test.com", "token")) is False
+    assert asyncio.run(utils.user.is_admin("error@test.com", "token")) is False
+    assert len(users_api_transport) == 2
+
+
+def test_is_admin_unexpected_error(users_api, monkeypatch):
+    async def fetch(user_id, token_authorization):
+        raise AttributeError("unexpected")
+
+    monkeypatch.setattr(utils.user, "_fetch_is_admin", fetch)
+    assert asyncio.run(utils.user.is_admin("user@test.com", None)) is False
@@ -0,0 +1,6 @@
+import datetime
+
+
+def to_millis(value: datetime.datetime) -> datetime.datetime:
+    """Drops the sub-millisecond part that Mongo does not store, so a document returned on create matches the stored one."""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
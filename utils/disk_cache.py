@@ -0,0 +1,174 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class DiskCache:
+    """Size capped LRU cache of files in a local directory, with hit/miss and bytes served counters.
+
+    Each worker tracks its own view of the directory, so the cap is enforced per worker: workers sharing a directory
+    can fill it up to workers x max_bytes, and a starting worker adopts the files already there up to its cap and
+    removes the rest.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()
+        self._size = 0
+        self._version = 0
+        self._loading = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        if max_bytes:
+            os.makedirs(directory, exist_ok=True)
+            entries = [entry for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.')]
+            for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                self._files[entry.name] = entry.stat().st_size
+                self._size += entry.stat().st_size
+            with self._lock:
+                self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _remove(self, key: str):
+        self._size -= self._files.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._files:
+            self._remove(next(iter(self._files)))
+
+    def get(self, key: str):
+        if not self.max_bytes:
+            return None
+        with self._lock:
+            if key in self._files and os.path.exists(self._path(key)):
+                self._files.move_to_end(key)
+                self.hits += 1
+                return self._path(key)
+            self._size -= self._files.pop(key, 0)
+            self.misses += 1
+            return None
+
+    def writer(self, key: str):
+        """Returns a CacheWriter that fills the entry, or None when it is cached or already being filled."""
+        with self._lock:
+            if not self.max_bytes or key in self._files or key in self._loading:
+                return None
+            self._loading.add(key)
+            return CacheWriter(self, key, self._version)
+
+    def _commit(self, key: str, tmp: str, version: int) -> bool:
+        size = os.path.getsize(tmp)
+        with self._lock:
+            # A delete while filling means the content changed, so the file may be stale
+            if size > self.max_bytes or version != self._version:
+                return False
+            os.replace(tmp, self._path(key))
+            self._files[key] = size
+            self._size += size
+            self._evict()
+            return True
+
+    def _finish(self, key: str, tmp: str):
+        with self._lock:
+            self._loading.discard(key)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    def put(self, key: str, write) -> bool:
+        """Fills the entry by calling write(path) on a temporary file."""
+        writer = self.writer(key)
+        if not writer:
+            return False
+        try:
+            write(writer.path)
+            return writer.commit()
+        finally:
+            writer.close()
+
+    def delete(self, *keys):
+        with self._lock:
+            self._version += 1
+            for key in keys:
+                self._remove(key)
+
+    def served(self, size: int):
+        with self._lock:
+            self.bytes_served += size
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            for key in list(self._files):
+                self._remove(key)
+            self.hits = 0
+            self.misses = 0
+            self.bytes_served = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "size": self._size,
+                "max_bytes": self.max_bytes,
+                "files": len(self._files),
+            }
+
+
+class CacheWriter:
+    """Fills a cache entry chunk by chunk, it becomes visible only on commit. Write errors abandon the entry."""
+
+    def __init__(self, cache: DiskCache, key: str, version: int):
+        self._cache = cache
+        self._key = key
+        self._version = version
+        self._file = None
+        self._failed = False
+        self._closed = False
+        self.path = cache._path(f".{key}.{uuid.uuid4().hex}")
+
+    def write(self, chunk: bytes):
+        if self._failed or self._closed:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'wb')
+            self._file.write(chunk)
+        except OSError:
+            self._failed = True
+
+    def commit(self, size: int = None) -> bool:
+        """Adds the entry if nothing failed and, when given, exactly size bytes were written."""
+        try:
+            if self._file is not None:
+                self._file.close()
+            if self._failed or self._closed or not os.path.exists(self.path):
+                return False
+            if size is not None and os.path.getsize(self.path) != size:
+                return False
+            return self._cache._commit(self._key, self.path, self._version)
+        except OSError:
+            return False
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+        self._cache._finish(self._key, self.path)
@@ -0,0 +1,12 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded pool for blocking pymongo/storage/HTTP calls so they never run on the event loop
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BLOCKING_POOL_SIZE', 16)), thread_name_prefix='blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,32 @@
+import os
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+# Serializes list responses with orjson straight from the service documents, skipping response_model validation.
+# shape() still fails on a missing required field and renders float fields as floats, like the model does, but
+# other values are sent as stored: a wrongly typed value is not coerced or rejected as the default response would.
+FAST_JSON_RESPONSES = os.getenv('FAST_JSON_RESPONSES', 'false').lower() == 'true'
+
+
+def _value(doc: dict, field):
+    value = doc[field.name] if field.required else doc.get(field.name)
+    if field.type_ is float and value is not None:
+        value = float(value)
+    return value
+
+
+def shape(docs: list[dict], model: type[BaseModel]) -> list[dict]:
+    """Keeps only the fields of the model, so internal fields of the documents are not sent.
+
+    Raises KeyError when a document misses a required field of the model.
+    """
+    fields = list(model.__fields__.values())
+    return [{field.name: _value(doc, field) for field in fields} for doc in docs]
+
+
+def list_response(docs: list[dict], model: type[BaseModel], response: Response):
+    if not FAST_JSON_RESPONSES:
+        return docs
+    return ORJSONResponse(shape(docs, model), headers=response.headers)
@@ -0,0 +1,127 @@
+# Seconds between entries of the seek table, entry i is the byte offset of the first frame at or after i * interval
+SEEK_TABLE_INTERVAL = 1
+# Content with no frame in this many bytes after the ID3 tag is not treated as MP3
+MAX_SYNC_SEARCH = 64 * 1024
+
+# Keyed by (MPEG-1, layer bits), in kbps
+_BITRATES = {
+    (True, 3): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 1): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 3): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 1): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Keyed by version bits: 3 is MPEG-1, 2 is MPEG-2, 0 is MPEG-2.5
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def parse_frame_header(header: bytes):
+    """Returns (frame length, samples, sample rate) of a valid MPEG audio frame header, None otherwise."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    padding = (header[2] >> 1) & 1
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    if layer == 3:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def _id3_size(header: bytes) -> int:
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class FrameIndex:
+    """Incremental MP3 frame scanner fed with consecutive chunks of a file."""
+
+    def __init__(self):
+        self._buffer = b""
+        self._offset = 0
+        self._skip = 0
+        self._started = False
+        self._sync_limit = MAX_SYNC_SEARCH
+        self._done = False
+        self.frames = 0
+        self.duration = 0.0
+        self.audio_bytes = 0
+        self.seek_table = []
+
+    def feed(self, chunk: bytes):
+        if not self._done:
+            self._buffer += chunk
+            self._scan(final=False)
+
+    def _scan(self, final: bool):
+        buffer = self._buffer
+        pos = 0
+        while not self._done:
+            if self._skip:
+                skipped = min(self._skip, len(buffer) - pos)
+                pos += skipped
+                self._skip -= skipped
+                if self._skip:
+                    break
+            if not self._started:
+                if len(buffer) - pos < 10 and not final:
+                    break
+                self._started = True
+                if buffer[pos:pos + 3] == b"ID3" and len(buffer) - pos >= 10:
+                    self._skip = _id3_size(buffer[pos:pos + 10])
+                    self._sync_limit += self._skip
+                    continue
+            if len(buffer) - pos < 4:
+                break
+            frame = parse_frame_header(buffer[pos:pos + 4])
+            if frame:
+                length = frame[0]
+                if len(buffer) - pos < length + 4 and not final:
+                    break
+                following = buffer[pos + length:pos + length + 4]
+                if len(following) < 4 or parse_frame_header(following):
+                    self._add_frame(self._offset + pos, *frame)
+                    self._skip = length
+                    continue
+            if not self.frames and self._offset + pos > self._sync_limit:
+                self._done = True
+                break
+            next_sync = buffer.find(b"\xff", pos + 1)
+            pos = next_sync if next_sync != -1 else len(buffer)
+        self._offset += pos
+        self._buffer = buffer[pos:]
+
+    def _add_frame(self, offset: int, length: int, samples: int, sample_rate: int):
+        while self.duration >= len(self.seek_table) * SEEK_TABLE_INTERVAL:
+            self.seek_table.append(offset)
+        self.frames += 1
+        self.duration += samples / sample_rate
+        self.audio_bytes += length
+
+    def result(self):
+        """Duration in seconds, average bitrate in kbps and seek table, or None when no frames were found."""
+        self._scan(final=True)
+        if not self.frames:
+            return None
+        return {
+            "duration": round(self.duration, 3),
+            "bitrate": round(self.audio_bytes * 8 / self.duration / 1000),
+            "seek_table": self.seek_table,
+        }
+
+
+def seek_offset(seek_table: list, seconds: float):
+    if not seek_table:
+        return None
+    return seek_table[min(int(seconds // SEEK_TABLE_INTERVAL), len(seek_table) - 1)]
@@ -0,0 +1,25 @@
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+BATCH_SIZE = 100
+
+
+def accepts_ndjson(accept: Optional[str]) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+def _lines(docs: Iterable[dict], model: type[BaseModel], prepare: Optional[Callable[[list], list]]):
+    docs = iter(docs)
+    while batch := list(islice(docs, BATCH_SIZE)):
+        if prepare:
+            batch = prepare(batch)
+        yield "".join(model(**doc).json() + "\n" for doc in batch)
+
+
+def ndjson_response(docs: Iterable[dict], model: type[BaseModel], prepare: Optional[Callable[[list], list]] = None,
+                    headers=None):
+    return StreamingResponse(_lines(docs, model, prepare), media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,82 @@
+import re
+
+from pymongo import UpdateOne
+
+# Documents store every substring (up to MAX_KEY_LENGTH chars) of every word of their searchable fields, plus
+# '^'-marked word prefixes used for ranking. A query matches with an indexed {'$all': terms} lookup, so user input
+# never reaches the regex engine.
+MAX_KEY_LENGTH = 12
+KEYS_FIELD = 'search_keys'
+SCORE_FIELD = 'score'
+_WORD = re.compile(r'\w+')
+
+
+def _words(text) -> list[str]:
+    return _WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def keys(*texts) -> list[str]:
+    result = set()
+    for word in (word for text in texts for word in _words(text)):
+        for start in range(len(word)):
+            for end in range(start + 1, min(start + MAX_KEY_LENGTH, len(word)) + 1):
+                result.add(word[start:end])
+        result.update('^' + word[:end] for end in range(1, min(MAX_KEY_LENGTH, len(word)) + 1))
+    return sorted(result)
+
+
+def document_keys(document: dict, fields: list[str]) -> list[str]:
+    return keys(*(document.get(field) for field in fields))
+
+
+def terms(q: str) -> list[str]:
+    return sorted({word[:MAX_KEY_LENGTH] for word in _words(q)})
+
+
+def query(q: str | None) -> str | None:
+    """Returns q when it has words to search, so a query of only punctuation or spaces acts as no filter."""
+    return q if q and terms(q) else None
+
+
+def match(q: str) -> dict:
+    return {KEYS_FIELD: {'$all': terms(q)}}
+
+
+def _score(q: str, name_field: str) -> dict:
+    q_terms = terms(q)
+    document_keys_expr = {'$ifNull': ['$' + KEYS_FIELD, []]}
+    return {
+        '$add': [
+            {'$cond': [{'$eq': [{'$toLower': '$' + name_field}, q.strip().lower()]}, 4, 0]},
+            {'$cond': [{'$setIsSubset': [['^' + term for term in q_terms], document_keys_expr]}, 2, 0]},
+            {'$cond': [{'$setIsSubset': [q_terms, document_keys_expr]}, 1, 0]},
+        ]
+    }
+
+
+def sort_stages(q: str = None, after=None, name_field: str = 'name') -> list:
+    stages = []
+    if q:
+        stages.append({'$addFields': {SCORE_FIELD: _score(q, name_field)}})
+    if after and q and after.score is not None:
+        stages.append({'$match': {'$or': [
+            {SCORE_FIELD: {'$lt': after.score}},
+            {SCORE_FIELD: after.score, '_id': {'$gt': after.id}}
+        ]}})
+    elif after:
+        stages.append({'$match': {'_id': {'$gt': after.id}}})
+    stages.append({'$sort': {SCORE_FIELD: -1, '_id': 1} if q else {'_id': 1}})
+    return stages
+
+
+def reindex(collection, fields: list[str], batch_size: int = 500) -> int:
+    count = 0
+    batch = []
+    for document in collection.find({}, {field: 1 for field in fields}):
+        batch.append(UpdateOne({'_id': document['_id']}, {'$set': {KEYS_FIELD: document_keys(document, fields)}}))
+        if len(batch) == batch_size:
+            count += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        count += collection.bulk_write(batch, ordered=False).modified_count
+    return count
@@ -1,19 +1,80 @@
-import requests
+import asyncio
+import logging
 import os
+
+import httpx
 from dotenv import load_dotenv
 from config.db import test
+from utils.cache import Cache
 
 load_dotenv()
 
+logger = logging.getLogger('main-logger')
+
+USERS_API_URL = os.getenv('USERS_API_URL', 'https://spotifiuby-api-gateway.herokuapp.com/users-api/users')
+
+_cache = Cache(maxsize=int(os.getenv('ADMIN_CACHE_SIZE', 4096)), ttl=float(os.getenv('ADMIN_CACHE_TTL', 60)))
+_in_flight = {}
+_client = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(os.getenv('USERS_API_TIMEOUT', 3))),
+            limits=httpx.Limits(max_connections=int(os.getenv('USERS_API_MAX_CONNECTIONS', 20)),
+                                max_keepalive_connections=int(os.getenv('USERS_API_MAX_CONNECTIONS', 20)))
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def cache_info() -> dict:
+    return _cache.info()
+
 
-def is_admin(user_id, token_authorization):
+def clear_cache():
+    _cache.clear()
+
+
+async def _fetch_is_admin(user_id, token_authorization) -> bool:
+    headers = {'x-api-key': os.getenv('BACKOFFICE_API_KEY'), 'Authorization': token_authorization}
+    r = await _get_client().get(f'{USERS_API_URL}/{user_id}',
+                                headers={k: v for k, v in headers.items() if v is not None})
+    r.raise_for_status()
+    user = r.json()
+    return isinstance(user, dict) and user.get('user_type') == 'admin'
+
+
+async def _lookup(key) -> bool:
+    try:
+        is_admin_user = await _fetch_is_admin(*key)
+    except Exception:
+        # Any failure counts as not admin and is not cached, so the next check retries
+        logger.exception(f"Could not check admin status of user {key[0]}")
+        return False
+    _cache.set(key, is_admin_user)
+    return is_admin_user
+
+
+async def is_admin(user_id, token_authorization) -> bool:
     if test:
         return True
-    x_api_key = os.getenv('BACKOFFICE_API_KEY')
-    r = requests.get(f'https://spotifiuby-api-gateway.herokuapp.com/users-api/users/{user_id}',
-                     headers={'x-api-key': x_api_key, 'Authorization': token_authorization})
-    user = r.json()
-    if 'user_type' in user:
-        return user['user_type'] == 'admin'
-    else:
+    if not user_id:
         return False
+    key = (user_id, token_authorization)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    # Concurrent checks of the same user share one request
+    if key not in _in_flight:
+        _in_flight[key] = asyncio.ensure_future(_lookup(key))
+        _in_flight[key].add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(_in_flight[key])
@@ -1,18 +1,34 @@
 import asyncio
+import base64
+import datetime
+import hashlib
 import logging
+import re
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import NamedTuple, Optional
 
 from bson import ObjectId
-from fastapi import HTTPException
+from bson.errors import InvalidId
+from fastapi import HTTPException, Response
 from starlette import status
 import os
 
 import service.song
-from exceptions.song_exceptions import SongNotFound, SongNotAvailable
+import service.subscription
+from exceptions.content_exceptions import RangeNotSatisfiable
+from exceptions.song_exceptions import SongNotFound, SongNotAvailable, InvalidSongs
 from models.song import SongModel
-from config.db import conn
+from utils import search
 
 logger = logging.getLogger('main-logger')
 
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 500))
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 500))
+NEXT_CURSOR_HEADER = 'x-next-cursor'
+MISSING_IDS_HEADER = 'x-missing-ids'
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 
 def verify_api_key(api_key):
     backoffice_app_api_key = os.getenv('BACKOFFICE_API_KEY')
@@ -53,22 +69,137 @@ def check_valid_album_id(album_id):
     return album_id
 
 
+class Cursor(NamedTuple):
+    id: ObjectId
+    score: Optional[int] = None
+
+
+def encode_cursor(last_id: str, score: int = None) -> str:
+    raw = ObjectId(last_id).binary
+    if score is not None:
+        raw += bytes([score])
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode())
+        if len(raw) == 13:
+            return Cursor(ObjectId(raw[:12]), raw[12])
+        return Cursor(ObjectId(raw))
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cursor '{cursor}' is not valid")
+
+
+def set_next_cursor(response, items: list, limit: int):
+    """Sets the cursor of the next page from the last item, with the rank the database sorted it by.
+
+    The rank is removed from the items, it is not part of the response.
+    """
+    scores = [item.pop(search.SCORE_FIELD, None) for item in items]
+    if items and len(items) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1]['id'], scores[-1])
+
+
+def parse_range(range_header: str | None, size: int):
+    """Returns the inclusive (start, end) of a single byte range, or None to send the whole content.
+
+    Malformed and multi-range headers are ignored, as allowed by RFC 7233.
+    """
+    match = _RANGE.match(range_header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            raise RangeNotSatisfiable(size)
+    if start >= size:
+        raise RangeNotSatisfiable(size)
+    return start, end
+
+
+def etag(data: str | bytes) -> str:
+    return '"' + hashlib.md5(data if isinstance(data, bytes) else data.encode()).hexdigest() + '"'
+
+
+def _is_not_modified(if_none_match: str | None, if_modified_since: str | None, tag: str | None,
+                     last_modified: datetime.datetime | None) -> bool:
+    if if_none_match:
+        tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+        return tag is not None and ('*' in tags or tag in tags)
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return last_modified.replace(tzinfo=datetime.timezone.utc, microsecond=0) <= since
+    return False
+
+
+def check_not_modified(response: Response, if_none_match: str | None, if_modified_since: str | None,
+                       tag: str = None, last_modified: datetime.datetime = None):
+    """Sets the validators on response and returns a 304 response when the client copy is still fresh.
+
+    Stored datetimes are naive UTC. If-Modified-Since is ignored when If-None-Match is present, as in RFC 7232.
+    """
+    if tag:
+        response.headers['etag'] = tag
+    if last_modified:
+        response.headers['last-modified'] = format_datetime(last_modified.replace(tzinfo=datetime.timezone.utc),
+                                                            usegmt=True)
+    if _is_not_modified(if_none_match, if_modified_since, tag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+    return None
+
+
 def _check_active_song(song: dict):
     return SongModel.is_active(song)
 
 
-def validate_song(song_id: str):
+def get_valid_song(song_id: str) -> dict:
     check_valid_song_id(song_id)
     song = service.song.get(song_id)
     if not song:
         raise SongNotFound(song_id)
     if not _check_active_song(song):
         raise SongNotAvailable(song_id)
+    return song
+
+
+def validate_song(song_id: str):
+    get_valid_song(song_id)
     return song_id
 
 
+def validate_songs(songs_ids: list[str]) -> list[str]:
+    """Checks every song with one query and reports all the failing ids, with the status of the first failure."""
+    valid_ids = [song_id for song_id in songs_ids if ObjectId.is_valid(song_id)]
+    statuses = service.song.get_statuses(valid_ids) if valid_ids else {}
+    errors = {}
+    for song_id in songs_ids:
+        if song_id in errors:
+            continue
+        if not ObjectId.is_valid(song_id):
+            errors[song_id] = HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                            detail=f"Song ID '{song_id}' is not valid")
+        elif str(ObjectId(song_id)) not in statuses:
+            errors[song_id] = SongNotFound(song_id)
+        elif not _check_active_song({"status": statuses[str(ObjectId(song_id))]}):
+            errors[song_id] = SongNotAvailable(song_id)
+    if errors:
+        raise InvalidSongs(errors)
+    return songs_ids
+
+
 def get_user_subscription(user_id):
-    user = conn.subscriptions.find_one({'user_id': user_id})
-    if not user:
-        return 0
-    return user['subscription_type_level']
+    return service.subscription.get_level(user_id)